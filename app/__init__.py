@@ -1,6 +1,6 @@
 # __init__.py file makes the directory it is in a package
 # import the Flask-MySQL connection function we created
-from app.db import init_db
+from app.db import init_db, get_engine
 
 from flask import Flask
 
@@ -10,6 +10,39 @@ from app.routes import home, dashboard, api
 # import filters for use
 from app.utils import filters
 
+# import the counters module so its listeners keep post vote/comment counts up to date
+from app.utils import counters
+
+# import the rendered HTML caches
+from app.utils import cache
+
+# import the upvote write-behind buffer
+from app.utils import votes
+
+# import the opt-in request profiler
+from app.utils.profiling import init_profiling
+
+# import Markup so Jinja doesn't escape the cached HTML
+from markupsafe import Markup
+
+# import the hashed, precompressed static assets
+from app.utils.assets import init_assets
+
+# import the version token that goes into the ETags
+from app.utils.conditional import app_version
+
+# import the command line tasks
+from app.commands import register_commands
+
+# import the per-client rate limits and the concurrency cap
+from app.utils.ratelimit import init_rate_limits
+
+# import the optional warm-up for new workers
+from app.utils.warmup import warm_up
+
+# Jinja can save compiled templates to disk, so a new worker doesn't compile them all again
+from jinja2 import FileSystemBytecodeCache
+
 # this creates a basic flask server
 # def = define
 def create_app(test_config=None):
@@ -21,10 +54,56 @@ def create_app(test_config=None):
   # i.e. /dashboard and /dashboard/ load the same route
   app.url_map.strict_slashes = False
   # app uses the key called 'super_secret_key' when creating server-side sessions
+  # PAGE_SIZE is how many posts the homepage and dashboard show per page
+  # COMMENT_PAGE_SIZE is how many comments a post page shows before the load more button
+  # POST_CARD_CACHE_SIZE is how many rendered post cards each worker keeps in memory
+  # FEED_CACHE_TTL is how many seconds a rendered homepage is reused for logged-out visitors
+  # VOTE_WRITE_BEHIND buffers upvotes in memory and writes them in batches
+  # of up to VOTE_FLUSH_SIZE votes every VOTE_FLUSH_MS milliseconds
+  # PROFILING adds a Server-Timing header to every response,
+  # and logs requests slower than SLOW_REQUEST_MS milliseconds (None turns the log off)
+  # TEMPLATE_CACHE saves compiled templates in TEMPLATE_CACHE_DIR
+  # (None means a folder Jinja picks in the system temp directory), so restarted workers reuse them
+  # WARM_UP compiles every template and fills the connection pool before create_app() returns
+  # RATE_LIMITS is how many requests each client may send to a route: (burst, period in seconds),
+  # counted in RATE_LIMIT_STORE (None keeps the counts in this worker, a file path shares them between workers)
+  # MAX_CONCURRENT_REQUESTS is how many requests a worker serves at once before answering 503
+  # (None means as many as the connection pool has connections, 0 means no limit)
+  # STATS_ENDPOINT turns on /api/stats, which shows the cache, pool and replica numbers to anyone who asks,
+  # so only turn it on where the route can't be reached from outside (i.e. behind an internal-only proxy rule)
+  # APP_VERSION goes into every page and api ETag, so a deploy invalidates the copies browsers have
+  # (None works it out from the templates and the asset manifest, see app/utils/conditional.py)
   app.config.from_mapping(
-    SECRET_KEY='super_secret_key'
+    SECRET_KEY='super_secret_key',
+    PAGE_SIZE=30,
+    COMMENT_PAGE_SIZE=50,
+    POST_CARD_CACHE_SIZE=1024,
+    FEED_CACHE_TTL=5,
+    VOTE_WRITE_BEHIND=False,
+    VOTE_FLUSH_MS=250,
+    VOTE_FLUSH_SIZE=500,
+    PROFILING=False,
+    SLOW_REQUEST_MS=500,
+    TEMPLATE_CACHE=True,
+    TEMPLATE_CACHE_DIR=None,
+    WARM_UP=False,
+    RATE_LIMITS={
+      'api.signup': (5, 600),
+      'api.login': (10, 60),
+      'api.comment': (10, 60),
+      'api.upvote': (60, 60),
+      'api.create': (5, 60)
+    },
+    RATE_LIMIT_STORE=None,
+    MAX_CONCURRENT_REQUESTS=None,
+    STATS_ENDPOINT=False,
+    APP_VERSION=None
   )
 
+  # let a test or deployment override the defaults above
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+
   # this turns the function into a route
   @app.route('/hello')
   # this is the function
@@ -39,13 +118,66 @@ def create_app(test_config=None):
   # pass in app variable we created 
   init_db(app)
 
+  # turn away clients that send too many writes, and requests the worker has no connection for,
+  # before they reach the database
+  init_rate_limits(app)
+
+  # time SQL and template rendering for every request if PROFILING is turned on
+  init_profiling(app)
+
   # register the filters we created
   app.jinja_env.filters['format_url'] = filters.format_url
   app.jinja_env.filters['format_date'] = filters.format_date
   app.jinja_env.filters['format_plural'] = filters.format_plural
 
+  # reuse the templates compiled by an earlier worker
+  if app.config['TEMPLATE_CACHE']:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+  # serve the built assets from /dist/ and give templates asset_url()
+  init_assets(app)
+
+  # work out the version the ETags include once, after flask build-assets has written the manifest
+  if app.config['APP_VERSION'] is None:
+    app.config['APP_VERSION'] = app_version(app)
+
+  # size the caches from the config
+  cache.post_cards.maxsize = app.config['POST_CARD_CACHE_SIZE']
+  cache.feed_pages.ttl = app.config['FEED_CACHE_TTL']
+
+  # templates call post_card(post) instead of including partials/post-info.html,
+  # so a card is only rendered again after the post changes
+  def render_post_card(post):
+    return app.jinja_env.get_template('partials/post-info.html').render(post=post)
+
+  def post_card(post):
+    return Markup(cache.get_post_card(post, render_post_card))
+
+  app.jinja_env.globals['post_card'] = post_card
+
+  # start writing upvotes in batches if write-behind mode is turned on
+  # after every batch, throw away the cached cards of the posts that got new votes
+  if app.config['VOTE_WRITE_BEHIND']:
+    def votes_flushed(new_votes):
+      for post_id in new_votes:
+        cache.invalidate_post(post_id)
+
+    votes.buffer.start(
+      get_engine(),
+      flush_ms=app.config['VOTE_FLUSH_MS'],
+      flush_size=app.config['VOTE_FLUSH_SIZE'],
+      on_flush=votes_flushed
+    )
+
   # register the api blueprint with the api we created so that any routes we create in api will become part of the Flask app
   # prefix will be /api
   app.register_blueprint(api)
 
+  # add our command line tasks, i.e. flask reconcile-counts
+  register_commands(app)
+
+  # get the templates and the connection pool ready before the first request arrives
+  if app.config['WARM_UP']:
+    warm_up(app)
+
   return app
\ No newline at end of file
@@ -0,0 +1,65 @@
+# serve the app from an ASGI server, i.e. hypercorn asgi:app
+# the read routes in app/routes/aio.py run on a Quart app with the async database session,
+# so one worker process keeps serving pages while other requests wait on MySQL
+# every other request goes to the usual Flask app, which runs in a thread like it does under a WSGI server
+
+from quart import Quart
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+from jinja2 import FileSystemBytecodeCache
+
+from app import create_app
+from app.db.aio import init_async_db
+from app.routes import aio
+from app.utils.warmup import compile_templates
+
+def create_asgi_app(test_config=None):
+  # the Flask app owns the config, the tables, the filters and the post card cache
+  flask_app = create_app(test_config)
+
+  # the Quart app only needs the templates; static files stay with the Flask app
+  quart_app = Quart(__name__, static_folder=None)
+  quart_app.url_map.strict_slashes = False
+  # the same SECRET_KEY and session cookie, so a user who logged in through Flask is logged in here too
+  quart_app.config.from_mapping(flask_app.config)
+
+  for name in ('format_url', 'format_date', 'format_plural'):
+    quart_app.jinja_env.filters[name] = flask_app.jinja_env.filters[name]
+  # post cards are still rendered (and cached) by the Flask app's template environment
+  quart_app.jinja_env.globals['post_card'] = flask_app.jinja_env.globals['post_card']
+  quart_app.jinja_env.globals['asset_url'] = flask_app.jinja_env.globals['asset_url']
+  # Quart compiles templates for async rendering, so its compiled copies can't share file names with Flask's
+  if flask_app.config['TEMPLATE_CACHE']:
+    quart_app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+      flask_app.config['TEMPLATE_CACHE_DIR'], pattern='__jinja2_async_%s.cache'
+    )
+
+  quart_app.register_blueprint(aio.bp)
+  init_async_db(quart_app)
+
+  # the Flask app warmed up its own templates, the Quart app compiles its copies separately
+  if flask_app.config['WARM_UP']:
+    compile_templates(quart_app.jinja_env)
+
+  wsgi_app = WsgiToAsgi(flask_app)
+  urls = quart_app.url_map.bind('localhost')
+
+  # True if the Quart app has a route for this request
+  def is_async_route(scope):
+    try:
+      urls.match(scope['path'], method=scope['method'])
+      return True
+    except HTTPException:
+      return False
+
+  async def app(scope, receive, send):
+    # the lifespan events start and stop the Quart app (and close the async engine's pool)
+    if scope['type'] == 'lifespan' or (scope['type'] == 'http' and is_async_route(scope)):
+      await quart_app(scope, receive, send)
+    else:
+      await wsgi_app(scope, receive, send)
+
+  # let the benchmark harness and scripts reach both apps
+  app.quart_app = quart_app
+  app.flask_app = flask_app
+  return app
@@ -0,0 +1,96 @@
+# this module holds the command line tasks we run with the flask command
+# i.e. FLASK_APP=app flask reconcile-counts
+
+# click is the library flask uses to build its command line interface
+import click
+# with_appcontext gives a command the app it was run for, i.e. to find app/static
+from flask.cli import with_appcontext
+
+from app.db import get_engine
+
+# recompute the stored post counters from the votes and comments tables
+@click.command('reconcile-counts')
+def reconcile_counts():
+  # import here so the listeners/models are only loaded when the command actually runs
+  from app.utils import counters
+
+  # engine.begin() opens a transaction and commits it when the block ends
+  with get_engine().begin() as connection:
+    updated = counters.reconcile(connection)
+
+  click.echo('Reconciled counters for {} posts'.format(updated))
+
+# create the tables in a new, empty database
+# the app no longer creates tables when it starts, so run this once before the first deploy
+# and flask migrate for every deploy after that
+@click.command('init-db')
+def init_db():
+  from app.db import Base, migrations, replicas
+
+  engine = get_engine()
+  Base.metadata.create_all(engine)
+  # the replica heartbeat isn't a model, so it has its own MetaData
+  replicas.metadata.create_all(engine)
+  # the new tables already have every migration's changes, so record the migrations as applied without running them
+  migrations.mark_applied(engine)
+  click.echo('Created the tables')
+
+# apply any schema migrations the database doesn't have yet
+# safe to run against the production database: it never drops tables or data
+@click.command('migrate')
+def migrate():
+  from app.db import migrations
+
+  applied = migrations.migrate(get_engine(), echo=click.echo)
+  click.echo('Applied {} migrations'.format(len(applied)) if applied else 'Database is up to date')
+
+# lower the hot scores of recent posts as they age
+# run this every few minutes from cron, i.e. */5 * * * * FLASK_APP=app flask redecay-scores
+@click.command('redecay-scores')
+@click.option('--all', 'all_posts', is_flag=True, help='rescore every post, not just the recent ones')
+def redecay_scores(all_posts):
+  from app.utils import ranking
+
+  updated = ranking.redecay(get_engine(), days=None if all_posts else ranking.REDECAY_DAYS)
+  click.echo('Rescored {} posts'.format(updated))
+
+# build the search index again from the posts and comments tables
+# the write routes keep it up to date, so this is only needed after a bulk import or if it got out of step
+@click.command('rebuild-search')
+def rebuild_search():
+  from app.utils import search
+
+  indexed = search.rebuild(get_engine())
+  click.echo('Indexed {} posts'.format(indexed))
+
+# store the domain of every post written before posts.domain was added
+# the write routes fill it in for new posts, so this only needs to run once after flask migrate
+@click.command('backfill-domains')
+def backfill_domains():
+  from app.utils import domains
+
+  updated = domains.backfill(get_engine())
+  click.echo('Stored the domain of {} posts'.format(updated))
+
+# minify, hash and precompress the CSS and JavaScript into app/static/dist
+# run this as part of every deploy, before the workers start
+@click.command('build-assets')
+@with_appcontext
+def build_assets():
+  from flask import current_app
+  from app.utils import assets
+
+  manifest = assets.build(current_app.static_folder)
+  click.echo('Built {} assets{}'.format(
+    len(manifest), '' if assets.brotli else ' (install brotli for .br copies)'
+  ))
+
+# add every command to the flask app
+def register_commands(app):
+  app.cli.add_command(init_db)
+  app.cli.add_command(reconcile_counts)
+  app.cli.add_command(migrate)
+  app.cli.add_command(redecay_scores)
+  app.cli.add_command(rebuild_search)
+  app.cli.add_command(backfill_domains)
+  app.cli.add_command(build_assets)
@@ -4,7 +4,7 @@
 # When the request ends, the context is removed from the app. 
 # These temporary contexts provide global variables, like the g object, 
 # that can be shared across modules as long as the context is still active
-from flask import g
+from flask import g, jsonify, request, session
 
 # getenv() function is part of Python's built-in os module
 from os import getenv
@@ -16,6 +16,21 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
 ### generate temporary connections for CRUD operations
 from sqlalchemy.orm import sessionmaker
+### raised when no pooled connection frees up within pool_timeout
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+### raised when a database can't be reached, i.e. a replica that is down
+from sqlalchemy.exc import OperationalError
+
+# perf_counter() times how long a request waits for a connection
+# time() stamps a user's last write for the read replicas
+from time import perf_counter, time
+# a Lock so two request threads don't both create the engine
+from threading import Lock
+
+# import the per-environment engine settings and the pool numbers
+from app.db.pool import engine_options, pool_stats, enable_foreign_keys
+# import the read replicas and the session that routes reads to them
+from app.db.replicas import replicas_from_env, RoutingSession
 
 # call load_dotenv() from the python-dotenv module
 # since in development, we use a .env file to fake the environment variable
@@ -24,32 +39,122 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# connect to database using env variable
-### create the connection to the database
-engine = create_engine(getenv('DB_URL'), echo=True, pool_size=20, max_overflow=0)
 # create Session class for connection for CRUD operations
-Session = sessionmaker(bind=engine)
+# RoutingSession uses the primary engine unless get_db() hands it a replica to read from
+# get_engine() binds it to the engine, so call that before using Session() outside a request
+Session = sessionmaker(class_=RoutingSession)
 # create a Base class variable to map the models to MySQL tables
 Base = declarative_base()
 
+# the engine and the read replicas are only created the first time something needs them,
+# so importing the app doesn't load the database driver or read the database settings,
+# and a server that forks workers doesn't share connections between them
+_engine = None
+_replicas = None
+_engine_lock = Lock()
+
+# return the engine, creating it the first time
+def get_engine():
+  global _engine, _replicas
+
+  if _engine is None:
+    with _engine_lock:
+      if _engine is None:
+        # connect to database using env variable
+        ### the DB_PROFILE environment variable (dev, test or prod) picks the logging and pool settings
+        url = getenv('DB_URL')
+        engine = create_engine(url, **engine_options(url))
+        # so ON DELETE CASCADE works on SQLite too
+        enable_foreign_keys(engine)
+        # the read replicas from REPLICA_DB_URLS, if there are any (see app/db/replicas.py)
+        _replicas = replicas_from_env()
+        Session.configure(bind=engine)
+        _engine = engine
+
+  return _engine
+
+# return the read replicas (which may be none at all)
+def get_replicas():
+  get_engine()
+  return _replicas
+
+# empty the connection pools of the engine and the read replicas, if they have been created
+## close=False only forgets the pooled connections without closing them,
+## which is what a forked worker needs: the connections belong to the parent process
+def dispose_engines(close=True):
+  if _engine is None:
+    return
+
+  _engine.dispose(close=close)
+  for engine in _replicas.engines:
+    engine.dispose(close=close)
+
 # this connects the flask app to the MySQL database
 # define the init_db function with app parameter passed in
-# call the base.metadata.create_all() method
-# which uses the Base class with the engine connection variable we created to build tables that Base has mapped
 # then have flask run close_db() together with its built-in teardown_appcontext() method
+# the tables aren't created here: run flask init-db once for a new database, and flask migrate after that,
+# so starting a worker never sends the database any DDL
 def init_db(app):
-  Base.metadata.create_all(engine)
   app.teardown_appcontext(close_db)
+  app.after_request(remember_write)
+  # answer 503 straight away when the pool is exhausted, instead of letting requests queue up behind it
+  app.register_error_handler(PoolTimeout, pool_exhausted)
 
 # define a function to return a new session-connection object
 # save the current connection on the 'g' object if it's not already there
 # return the connection from the 'g' object instead of create a new session instance every time
 def get_db():
   if 'db' not in g:
+    # a route that only reads (see read_from_replica()) gets a replica,
+    # unless none has caught up with this user's last write
+    replicas = get_replicas()
+    replica = None
+    if g.get('read_replica'):
+      replica = replicas.choose(get_engine(), session.get('last_write', 0))
+
     # store db connection in app context
-    g.db = Session()
+    g.db = Session(replica=replica)
+    try:
+      check_out(g.db)
+    except OperationalError:
+      # the replica couldn't be reached, so stop using it for now and read from the primary
+      if replica is None:
+        raise
+      replicas.mark_down(replica)
+      g.db.close()
+      g.db = Session()
+      check_out(g.db)
   return g.db
 
+# check out the session's connection now so we can time how long the pool made us wait
+# if nothing frees up within pool_timeout this raises PoolTimeout, which becomes a 503
+def check_out(db):
+  start = perf_counter()
+  try:
+    db.connection()
+  except PoolTimeout:
+    pool_stats.record_timeout()
+    raise
+  pool_stats.record_wait(perf_counter() - start)
+
+# the home and dashboard blueprints run this before each request
+# their GET routes only read, so they may use a replica
+def read_from_replica():
+  g.read_replica = request.method in ('GET', 'HEAD')
+
+# after a request that wrote to the primary, remember when in the user's session cookie,
+# so their next pages aren't read from a replica that hasn't caught up with the write yet
+def remember_write(response):
+  db = g.get('db')
+  if db is not None and get_replicas().engines and (db.wrote or request.method not in ('GET', 'HEAD')):
+    session['last_write'] = time()
+  return response
+
+# the error handler for PoolTimeout
+# tell the client the server is busy and when to try again, rather than letting the request hang
+def pool_exhausted(e):
+  return jsonify(message = 'Server busy, try again shortly'), 503, {'Retry-After': '1'}
+
 # we need to remember to close the connection to the database so that the app doesn't crash in production
 # creating a function allows us to avoid adding db.close to every route we create
 def close_db(e=None):
@@ -0,0 +1,95 @@
+# the async version of get_db() and close_db(), for the read routes served over ASGI (see app/asgi.py)
+# the sync engine in app/db/__init__.py ties up a worker thread for every query a request waits on;
+# with an asyncio engine one worker keeps serving other requests while MySQL answers
+# it needs an async database driver as well as SQLAlchemy's asyncio extension:
+# pip install quart aiomysql asgiref   (or aiosqlite for a SQLite DB_URL)
+
+from os import getenv
+from time import perf_counter
+
+from quart import g, jsonify
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.db.pool import engine_options, enable_foreign_keys, PoolStats
+
+# the async driver to use for each sync driver a DB_URL can name
+ASYNC_DRIVERS = {
+  'mysql': 'mysql+aiomysql',
+  'mysql+pymysql': 'mysql+aiomysql',
+  'mysql+mysqldb': 'mysql+aiomysql',
+  'sqlite': 'sqlite+aiosqlite',
+  'sqlite+pysqlite': 'sqlite+aiosqlite'
+}
+
+# ASYNC_DB_URL if it is set, otherwise DB_URL with its driver swapped for the async one
+def async_url():
+  url = getenv('ASYNC_DB_URL')
+  if url:
+    return url
+
+  url = make_url(getenv('DB_URL'))
+  return str(url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)))
+
+# the async engine is only created the first time a request needs it,
+# so importing this module doesn't need the async driver installed
+_engine = None
+AsyncSessionLocal = None
+
+# how long async requests waited for a connection, kept apart from the sync engine's numbers
+async_pool_stats = PoolStats()
+
+def get_async_engine():
+  global _engine, AsyncSessionLocal
+
+  if _engine is None:
+    url = async_url()
+    # the same DB_PROFILE settings as the sync engine, so both pools are sized the same way
+    _engine = create_async_engine(url, **engine_options(url))
+    enable_foreign_keys(_engine.sync_engine)
+    # expire_on_commit=False so templates can read a post after the session is done with it,
+    # since an async session can't load expired attributes lazily
+    AsyncSessionLocal = sessionmaker(bind=_engine, class_=AsyncSession, expire_on_commit=False)
+
+  return _engine
+
+# the async version of get_db(): one AsyncSession per request, saved on the g object
+async def get_async_db():
+  if 'async_db' not in g:
+    get_async_engine()
+    g.async_db = AsyncSessionLocal()
+
+    # check out the connection now so we can time how long the pool made us wait
+    start = perf_counter()
+    try:
+      await g.async_db.connection()
+    except PoolTimeout:
+      async_pool_stats.record_timeout()
+      raise
+    async_pool_stats.record_wait(perf_counter() - start)
+  return g.async_db
+
+# the async version of close_db(), run when the request's app context ends
+async def close_async_db(e=None):
+  db = g.pop('async_db', None)
+  if db is not None:
+    await db.close()
+
+# close every pooled connection when the server shuts down
+async def dispose_async_engine():
+  if _engine is not None:
+    await _engine.dispose()
+
+# the same 503 as the sync routes send when the pool is exhausted
+async def pool_exhausted(e):
+  return jsonify(message = 'Server busy, try again shortly'), 503, {'Retry-After': '1'}
+
+# the async version of init_db(app), for the Quart app in app/asgi.py
+# the tables already exist, since the Flask app is always created first
+def init_async_db(app):
+  app.teardown_appcontext(close_async_db)
+  app.after_serving(dispose_async_engine)
+  app.register_error_handler(PoolTimeout, pool_exhausted)
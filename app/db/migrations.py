@@ -0,0 +1,247 @@
+# a small versioned migration runner
+# Base.metadata.create_all() only creates tables that don't exist yet, so it never adds new columns or indexes
+# to a database that already has data in it, and seeds.py drops everything first
+# each migration below is applied once, in order, and recorded in the schema_migrations table
+
+from datetime import datetime
+
+# inspect() lets us ask the database which columns and indexes already exist
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, inspect, text, select
+
+# schema_migrations lives on its own MetaData so create_all() on the models never touches it
+metadata = MetaData()
+
+schema_migrations = Table(
+  'schema_migrations', metadata,
+  Column('version', Integer, primary_key=True),
+  Column('name', String(100), nullable=False),
+  Column('applied_at', DateTime, default=datetime.now)
+)
+
+# every migration, in the order it has to run
+# each entry is (version, name, function that receives a connection)
+MIGRATIONS = []
+
+# decorator that adds a function to MIGRATIONS
+def migration(version, name):
+  def register(func):
+    MIGRATIONS.append((version, name, func))
+    return func
+
+  return register
+
+# helpers so every migration can be run against a database that already has the change
+# (i.e. one created by create_all() after the models were updated)
+def has_column(connection, table, column):
+  return column in [c['name'] for c in inspect(connection).get_columns(table)]
+
+def has_index(connection, table, name):
+  inspector = inspect(connection)
+  names = [i['name'] for i in inspector.get_indexes(table)]
+  names += [c['name'] for c in inspector.get_unique_constraints(table)]
+  return name in names
+
+# create the indexes with the given names that the model declares, unless the database already has them
+## only name the indexes a migration introduces: a later migration's index may need a column that doesn't exist yet
+def create_missing_indexes(connection, table, names):
+  for index in table.indexes:
+    if index.name in names and not has_index(connection, table.name, index.name):
+      index.create(connection)
+
+@migration(1, 'add post vote and comment counters')
+def add_post_counters(connection):
+  # import here because the models import app.db, which imports this module's package
+  from app.utils import counters
+
+  for column in ('vote_count', 'comment_count'):
+    if not has_column(connection, 'posts', column):
+      connection.execute(text(
+        'ALTER TABLE posts ADD COLUMN {} INTEGER NOT NULL DEFAULT 0'.format(column)
+      ))
+
+  # fill the new columns from the votes and comments tables
+  counters.reconcile(connection)
+
+@migration(2, 'one vote per user per post')
+def unique_votes(connection):
+  from app.utils import counters
+
+  if has_index(connection, 'votes', 'uq_votes_post_user'):
+    return
+
+  # keep the first vote of every (post_id, user_id) pair and delete the repeats
+  ## MySQL won't DELETE from a table that a subquery reads from, so the ids to keep go through a derived table
+  connection.execute(text(
+    'DELETE FROM votes WHERE id NOT IN ('
+    'SELECT id FROM (SELECT MIN(id) AS id FROM votes GROUP BY post_id, user_id) AS keep'
+    ')'
+  ))
+  # plain DDL rather than an Index() on Vote's columns, which would add the index to the model's table for good
+  # and every later votes.create() (i.e. migration 6 on SQLite) would build it next to the model's UniqueConstraint
+  connection.execute(text('CREATE UNIQUE INDEX uq_votes_post_user ON votes (post_id, user_id)'))
+
+  # the repeats were counted, so count again without them
+  counters.reconcile(connection)
+
+@migration(3, 'indexes for the feed and comment queries')
+def feed_indexes(connection):
+  from app.models import Post, Comment
+
+  create_missing_indexes(connection, Post.__table__, ['ix_posts_created_at_id', 'ix_posts_user_id_created_at'])
+  create_missing_indexes(connection, Comment.__table__, ['ix_comments_post_id_created_at'])
+
+@migration(4, 'hot ranking score')
+def hot_score(connection):
+  from app.models import Post
+  from app.utils import ranking
+
+  if not has_column(connection, 'posts', 'hot_score'):
+    connection.execute(text('ALTER TABLE posts ADD COLUMN hot_score DOUBLE NOT NULL DEFAULT 0'))
+  create_missing_indexes(connection, Post.__table__, ['ix_posts_hot_score_id'])
+
+  # give every post its first score
+  ids = [row[0] for row in connection.execute(select([Post.id]))]
+  for i in range(0, len(ids), ranking.REDECAY_CHUNK):
+    ranking.refresh_scores(connection, ids[i:i + ranking.REDECAY_CHUNK])
+
+@migration(5, 'search index')
+def search_index(connection):
+  from app.models import SearchTerm
+  from app.utils import search
+
+  SearchTerm.__table__.create(connection, checkfirst=True)
+
+  # index every post that is already there
+  connection.execute(SearchTerm.__table__.delete())
+  last_id, count = search.index_chunk(connection, 0)
+  while count:
+    last_id, count = search.index_chunk(connection, last_id)
+
+# True if the table's post_id foreign key already has ON DELETE CASCADE
+def post_fk_cascades(connection, table):
+  for fk in inspect(connection).get_foreign_keys(table):
+    if fk['constrained_columns'] == ['post_id']:
+      return (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE'
+  return False
+
+# give a table's post_id foreign key ON DELETE CASCADE, like the model declares
+## table is the model's Table, i.e. Comment.__table__
+def cascade_post_fk(connection, table):
+  if post_fk_cascades(connection, table.name):
+    return
+
+  # MySQL can swap the foreign key in place
+  if connection.dialect.name == 'mysql':
+    for fk in inspect(connection).get_foreign_keys(table.name):
+      if fk['constrained_columns'] == ['post_id']:
+        connection.execute(text('ALTER TABLE {} DROP FOREIGN KEY {}'.format(table.name, fk['name'])))
+    connection.execute(text(
+      'ALTER TABLE {} ADD FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE'.format(table.name)
+    ))
+    return
+
+  # SQLite can't change a foreign key, so build the table again from the model and copy the rows over
+  ## the old table's indexes keep their names when it is renamed, so drop them first to free the names up
+  old = table.name + '_old'
+  connection.execute(text('ALTER TABLE {} RENAME TO {}'.format(table.name, old)))
+  for index in inspect(connection).get_indexes(old):
+    connection.execute(text('DROP INDEX {}'.format(index['name'])))
+  table.create(connection)
+
+  columns = ', '.join(column.name for column in table.columns)
+  connection.execute(text('INSERT INTO {0} ({1}) SELECT {1} FROM {2}'.format(table.name, columns, old)))
+  connection.execute(text('DROP TABLE {}'.format(old)))
+
+@migration(6, 'delete comments, votes and search terms with their post')
+def cascade_deletes(connection):
+  from app.models import Comment, Vote, SearchTerm
+  from app.utils import counters
+
+  for table in (Comment.__table__, Vote.__table__, SearchTerm.__table__):
+    # posts deleted before now may have left rows behind, and the new foreign key would refuse them
+    connection.execute(text(
+      'DELETE FROM {} WHERE post_id IS NOT NULL AND post_id NOT IN (SELECT id FROM posts)'.format(table.name)
+    ))
+    # SQLite didn't check foreign keys before, so there may be rows from users that don't exist either
+    if 'user_id' in table.c:
+      connection.execute(text(
+        'DELETE FROM {} WHERE user_id IS NOT NULL AND user_id NOT IN (SELECT id FROM users)'.format(table.name)
+      ))
+    cascade_post_fk(connection, table)
+
+  # the deleted rows were counted
+  counters.reconcile(connection)
+
+@migration(7, 'post url domain')
+def post_domain(connection):
+  from app.models import Post
+
+  if not has_column(connection, 'posts', 'domain'):
+    connection.execute(text('ALTER TABLE posts ADD COLUMN domain VARCHAR(100)'))
+  create_missing_indexes(connection, Post.__table__, ['ix_posts_domain_created_at'])
+  # the column is filled in by flask backfill-domains, in short transactions, after the deploy
+
+@migration(8, 'hot score as a double')
+def hot_score_double(connection):
+  # migration 4 used to add hot_score as a FLOAT, which MySQL stores in single precision
+  ## SQLite always stores REAL as a double, so only MySQL needs the change
+  if connection.dialect.name == 'mysql':
+    connection.execute(text('ALTER TABLE posts MODIFY hot_score DOUBLE NOT NULL DEFAULT 0'))
+
+@migration(9, 'replica heartbeat table')
+def heartbeat_table(connection):
+  from app.db import replicas
+
+  # the lag check (see app/db/replicas.py) writes to it on the primary and reads it back from every replica
+  replicas.replica_heartbeat.create(connection, checkfirst=True)
+
+@migration(10, 'replica heartbeat as a double')
+def heartbeat_double(connection):
+  # migration 9 used to create beat as a FLOAT, which MySQL stores in single precision,
+  # far too coarse for a lag measured in seconds
+  if connection.dialect.name == 'mysql':
+    connection.execute(text('ALTER TABLE replica_heartbeat MODIFY beat DOUBLE NOT NULL'))
+
+# return the versions that have already been applied
+def applied_versions(connection):
+  metadata.create_all(connection)
+  return set(row[0] for row in connection.execute(schema_migrations.select()))
+
+# apply every migration that hasn't been applied yet, each in its own transaction
+## engine is the engine from app.db
+## echo is a function that reports progress, i.e. click.echo
+# returns the list of versions that were applied
+def migrate(engine, echo=print):
+  with engine.begin() as connection:
+    done = applied_versions(connection)
+
+  applied = []
+  for version, name, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+    if version in done:
+      continue
+
+    echo('Applying migration {}: {}'.format(version, name))
+    with engine.begin() as connection:
+      func(connection)
+      connection.execute(schema_migrations.insert().values(version=version, name=name))
+    applied.append(version)
+
+  return applied
+
+# record every migration as applied without running it
+# for a new database whose tables were just created from the models (see flask init-db),
+# so they already have every migration's changes
+## engine is the engine from app.db
+# returns the list of versions that were recorded
+def mark_applied(engine):
+  with engine.begin() as connection:
+    done = applied_versions(connection)
+    rows = [
+      {'version': version, 'name': name}
+      for version, name, func in sorted(MIGRATIONS, key=lambda m: m[0])
+      if version not in done
+    ]
+    if rows:
+      connection.execute(schema_migrations.insert(), rows)
+
+  return [row['version'] for row in rows]
@@ -0,0 +1,143 @@
+# engine settings for each environment, and numbers about how busy the connection pool is
+
+from os import getenv
+# event lets us run a statement on every new connection
+from sqlalchemy import event
+# a Lock keeps the wait time histogram consistent when many request threads record at once
+from threading import Lock
+
+# settings for create_engine() in each environment
+## echo logs every SQL statement, which is handy in development and far too noisy in production
+## pool_size and max_overflow cap how many connections one worker holds open
+## pool_timeout is how many seconds a request waits for a free connection before we answer 503
+## pool_pre_ping checks a connection still works before handing it out, so a restarted MySQL doesn't cause errors
+## pool_recycle replaces connections older than this many seconds, before MySQL's wait_timeout closes them
+PROFILES = {
+  'dev': {
+    'echo': True,
+    'pool_size': 20,
+    'max_overflow': 0,
+    'pool_timeout': 30,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600
+  },
+  'test': {
+    'echo': False,
+    'pool_size': 5,
+    'max_overflow': 0,
+    'pool_timeout': 5,
+    'pool_pre_ping': False,
+    'pool_recycle': 3600
+  },
+  'prod': {
+    'echo': False,
+    'pool_size': 20,
+    'max_overflow': 5,
+    'pool_timeout': 2,
+    'pool_pre_ping': True,
+    'pool_recycle': 280
+  }
+}
+
+# environment variables that override a single setting of the chosen profile, and how to read them
+OVERRIDES = {
+  'DB_ECHO': ('echo', lambda value: value.lower() in ('1', 'true', 'yes')),
+  'DB_POOL_SIZE': ('pool_size', int),
+  'DB_MAX_OVERFLOW': ('max_overflow', int),
+  'DB_POOL_TIMEOUT': ('pool_timeout', float),
+  'DB_POOL_PRE_PING': ('pool_pre_ping', lambda value: value.lower() in ('1', 'true', 'yes')),
+  'DB_POOL_RECYCLE': ('pool_recycle', int)
+}
+
+# settings that only make sense for a real connection pool
+POOL_SETTINGS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+
+# build the create_engine() keyword arguments for the DB_PROFILE environment variable (dev by default)
+def engine_options(url):
+  profile = getenv('DB_PROFILE', 'dev')
+  if profile not in PROFILES:
+    raise ValueError('Unknown DB_PROFILE {!r}, expected one of {}'.format(profile, ', '.join(PROFILES)))
+
+  options = dict(PROFILES[profile])
+  for name, (setting, parse) in OVERRIDES.items():
+    value = getenv(name)
+    if value is not None:
+      options[setting] = parse(value)
+
+  # SQLite (i.e. for local benchmarks) doesn't use a sized pool, so drop those settings
+  if url and url.startswith('sqlite'):
+    for setting in POOL_SETTINGS:
+      options.pop(setting, None)
+
+  return options
+
+# SQLite ignores foreign keys (and so ON DELETE CASCADE) unless each connection turns them on
+## engine is a sync engine; for an async engine pass its sync_engine
+def enable_foreign_keys(engine):
+  if engine.dialect.name != 'sqlite':
+    return
+
+  @event.listens_for(engine, 'connect')
+  def foreign_keys_on(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+# how long requests waited for a connection, counted in buckets of milliseconds
+# the last bucket (None) catches everything slower than the one before it
+WAIT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, None)
+
+class PoolStats:
+  def __init__(self):
+    self._lock = Lock()
+    self.reset()
+
+  def reset(self):
+    self.checkouts = 0
+    self.timeouts = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+    self.histogram = [0] * len(WAIT_BUCKETS)
+
+  # record how many seconds a request waited for its connection
+  def record_wait(self, seconds):
+    ms = seconds * 1000
+    with self._lock:
+      self.checkouts += 1
+      self.total_wait += seconds
+      self.max_wait = max(self.max_wait, seconds)
+      for i, bucket in enumerate(WAIT_BUCKETS):
+        if bucket is None or ms <= bucket:
+          self.histogram[i] += 1
+          break
+
+  # record a request that gave up waiting for a connection
+  def record_timeout(self):
+    with self._lock:
+      self.timeouts += 1
+
+  # numbers for the /api/stats route
+  ## pool is engine.pool; the live numbers are only there for a sized pool (not SQLite)
+  def snapshot(self, pool):
+    with self._lock:
+      stats = {
+        'checkouts': self.checkouts,
+        'timeouts': self.timeouts,
+        'avg_wait_ms': self.total_wait * 1000 / self.checkouts if self.checkouts else 0.0,
+        'max_wait_ms': self.max_wait * 1000,
+        # a list rather than a dictionary so the buckets stay in order in the JSON
+        ## le_ms is the bucket's upper bound in milliseconds, None for the last (slowest) bucket
+        'wait_ms_histogram': [
+          {'le_ms': bucket, 'count': count}
+          for bucket, count in zip(WAIT_BUCKETS, self.histogram)
+        ]
+      }
+
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+      if hasattr(pool, name):
+        stats[name] = getattr(pool, name)()
+
+    return stats
+
+# the numbers for this worker's engine
+pool_stats = PoolStats()
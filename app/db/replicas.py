@@ -0,0 +1,171 @@
+# read replicas for the pages that only read the database
+# without them every feed render shares the one primary database with every write
+# set REPLICA_DB_URLS to a comma-separated list of database URLs and the GET routes in home.py and dashboard.py
+# read from a replica, while the api's writes (and any query after a write) still go to the primary
+#
+# a replica applies the primary's writes a little later, so two things send a request back to the primary:
+## lag: a replica more than REPLICA_MAX_LAG seconds behind isn't used until it catches up
+## read-your-writes: after a user writes something, their pages come from the primary
+## until a replica has caught up with that write
+#
+# both are measured with a heartbeat: every REPLICA_LAG_CHECK seconds each worker writes the time into
+# the replica_heartbeat table on the primary and reads it back from every replica,
+# so the time a replica has is how far it has caught up
+#
+# to try it locally with two SQLite files:
+# DB_URL=sqlite:///primary.db REPLICA_DB_URLS=sqlite:///replica.db flask run
+# and copy primary.db over replica.db whenever the "replica" should catch up
+
+import logging
+from os import getenv
+# time() rather than perf_counter(), since the heartbeat has to mean the same thing in every worker
+from time import time
+# a Lock so only one request thread at a time runs the lag check
+from threading import Lock
+
+from sqlalchemy import create_engine, Table, Column, Integer, Float, MetaData, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+# UpdateBase is what INSERT, UPDATE and DELETE statements have in common
+from sqlalchemy.sql.dml import UpdateBase
+
+from app.db.pool import engine_options, enable_foreign_keys
+
+logger = logging.getLogger(__name__)
+
+# the heartbeat lives on its own MetaData, like schema_migrations, so create_all() on the models never touches it
+## migration 9 creates it (see app/db/migrations.py), and flask init-db for a new database
+metadata = MetaData()
+
+replica_heartbeat = Table(
+  'replica_heartbeat', metadata,
+  Column('id', Integer, primary_key=True),
+  # seconds since the epoch, as time() returns them
+  ## precision=53 makes it a DOUBLE on MySQL: a single-precision FLOAT rounds today's time() to steps of 128 seconds
+  Column('beat', Float(precision=53), nullable=False)
+)
+
+class Replicas:
+  ## urls is the list of replica database URLs, which can be empty
+  ## max_lag is how many seconds behind the primary a replica may be and still be used
+  ## check_interval is how many seconds a worker waits between lag checks
+  def __init__(self, urls, max_lag=5, check_interval=1):
+    self.engines = []
+    for url in urls:
+      engine = create_engine(url, **engine_options(url))
+      enable_foreign_keys(engine)
+      self.engines.append(engine)
+
+    self.max_lag = max_lag
+    self.check_interval = check_interval
+    self._lock = Lock()
+    self._checked_at = 0.0
+    self._next = 0
+    # for each replica, the heartbeat it had at the last check (how far it has caught up) and how far behind
+    # the primary that was, or None if it couldn't be read
+    self.caught_up = [None] * len(self.engines)
+    self.lag = [None] * len(self.engines)
+
+  # write a new heartbeat to the primary, then read it back from every replica
+  ## primary is the engine from app.db
+  def check(self, primary):
+    now = time()
+    try:
+      with primary.begin() as connection:
+        updated = connection.execute(
+          replica_heartbeat.update().where(replica_heartbeat.c.id == 1).values(beat=now)
+        ).rowcount
+        if not updated:
+          connection.execute(replica_heartbeat.insert().values(id=1, beat=now))
+    except SQLAlchemyError:
+      # i.e. the primary is down, or flask migrate hasn't created the heartbeat table yet
+      # the replicas then look further and further behind, so requests move to the primary by themselves
+      logger.exception('Could not write the replica heartbeat')
+
+    for i, engine in enumerate(self.engines):
+      try:
+        with engine.connect() as connection:
+          beat = connection.execute(
+            select([replica_heartbeat.c.beat]).where(replica_heartbeat.c.id == 1)
+          ).scalar()
+      except SQLAlchemyError as e:
+        # i.e. the replica is down, or its copy of the database doesn't have the heartbeat yet
+        logger.warning('Replica %s could not be read, using the primary instead: %s', i, getattr(e, 'orig', None) or e)
+        beat = None
+
+      self.caught_up[i] = beat
+      self.lag[i] = None if beat is None else max(now - beat, 0.0)
+
+    self._checked_at = now
+
+  # pick a replica to read from, or None if the request has to use the primary
+  ## last_write is when this user last wrote something (from their session cookie), 0 if never
+  def choose(self, primary, last_write=0):
+    if not self.engines:
+      return None
+
+    # check the lag if it's due, unless another request thread is already doing it
+    if time() - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+      try:
+        self.check(primary)
+      finally:
+        self._lock.release()
+
+    usable = [
+      engine
+      for engine, caught_up, lag in zip(self.engines, self.caught_up, self.lag)
+      if caught_up is not None and lag <= self.max_lag and caught_up >= last_write
+    ]
+    if not usable:
+      return None
+
+    # take turns between the usable replicas
+    self._next += 1
+    return usable[self._next % len(usable)]
+
+  # stop using a replica that failed a request until the next check shows it is back
+  def mark_down(self, engine):
+    i = self.engines.index(engine)
+    self.caught_up[i] = None
+    self.lag[i] = None
+
+  # numbers for the /api/stats route
+  def stats(self):
+    return [
+      {
+        'replica': i,
+        'lag_s': None if lag is None else round(lag, 3),
+        'usable': caught_up is not None and lag <= self.max_lag
+      }
+      for i, (caught_up, lag) in enumerate(zip(self.caught_up, self.lag))
+    ]
+
+# build the replicas from the REPLICA_DB_URLS, REPLICA_MAX_LAG and REPLICA_LAG_CHECK environment variables
+def replicas_from_env():
+  urls = [url.strip() for url in getenv('REPLICA_DB_URLS', '').split(',') if url.strip()]
+  return Replicas(
+    urls,
+    max_lag=float(getenv('REPLICA_MAX_LAG', 5)),
+    check_interval=float(getenv('REPLICA_LAG_CHECK', 1))
+  )
+
+# a Session that sends its reads to a replica and everything else to the primary
+class RoutingSession(Session):
+  ## replica is the engine to read from, or None to use the primary for everything
+  def __init__(self, replica=None, **kwargs):
+    super().__init__(**kwargs)
+    self.replica = replica
+    # True once the session has sent the primary a write
+    self.wrote = False
+
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    # a flush or an INSERT, UPDATE or DELETE has to go to the primary,
+    # and so does every read after it, so the request sees what it just wrote
+    if self._flushing or isinstance(clause, UpdateBase):
+      self.wrote = True
+      self.replica = None
+
+    if self.replica is not None:
+      return self.replica
+
+    return super().get_bind(mapper=mapper, clause=clause, **kwargs)
@@ -1,14 +1,19 @@
 from datetime import datetime
 from app.db import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 
 class Comment(Base):
   __tablename__ = 'comments'
+  # the post pages load a post's comments in the order they were written
+  __table_args__ = (
+    Index('ix_comments_post_id_created_at', 'post_id', 'created_at'),
+  )
   id = Column(Integer, primary_key=True)
   comment_text = Column(String(255), nullable=False)
   user_id = Column(Integer, ForeignKey('users.id'))
-  post_id = Column(Integer, ForeignKey('posts.id'))
+  # ON DELETE CASCADE: the database deletes a post's comments together with the post
+  post_id = Column(Integer, ForeignKey('posts.id', ondelete='CASCADE'))
   created_at = Column(DateTime, default=datetime.now)
   updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -2,32 +2,51 @@
 ### datetime is a python module to generate timestamps
 from datetime import datetime
 ### need to use ForeignKey and DateTime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, select, func
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, Float
 ### relationship allows us to return additional information when other tables are referenced
-from sqlalchemy.orm import relationship, column_property
+from sqlalchemy.orm import relationship
 from app.db import Base
-from .Vote import Vote
 
 # reminder: SQLAlchemy models written as Python classes
 class Post(Base):
   __tablename__ = 'posts'
+  # indexes for the feed queries
+  ## the homepage pages through every post by (created_at, id), newest first
+  ## the dashboard pages through one user's posts the same way
+  ## the hot feed pages through every post by (hot_score, id), highest first
+  ## the /from/<domain> feed pages through one domain's posts by (created_at, id), newest first
+  __table_args__ = (
+    Index('ix_posts_created_at_id', 'created_at', 'id'),
+    Index('ix_posts_user_id_created_at', 'user_id', 'created_at', 'id'),
+    Index('ix_posts_hot_score_id', 'hot_score', 'id'),
+    Index('ix_posts_domain_created_at', 'domain', 'created_at', 'id'),
+  )
   id = Column(Integer, primary_key=True)
   title = Column(String(100), nullable=False)
   post_url = Column(String(100), nullable=False)
+  # the domain post_url links to, i.e. example.com (see app/utils/domains.py)
+  # NULL for posts written before the column was added, until flask backfill-domains has run
+  domain = Column(String(100))
   # define as a ForeignKey that references the users table
   user_id = Column(Integer, ForeignKey('users.id'))
   # utilize Python's datetime module
   created_at = Column(DateTime, default=datetime.now)
   updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
-  vote_count = column_property(
-    #  func.count method counts the number of Vote.id instances from votes model where the post_id is equal to the id of the accessed post
-    select([func.count(Vote.id)]).where(Vote.post_id == id)
-  )
+  # store the number of votes and comments on the post itself so rendering a feed doesn't count them every time
+  # api.upvote and api.comment keep these up to date in the same transaction as the vote/comment insert
+  # (see app/utils/counters.py)
+  vote_count = Column(Integer, nullable=False, default=0, server_default='0')
+  comment_count = Column(Integer, nullable=False, default=0, server_default='0')
+  # the stored "hot" ranking score for the homepage (see app/utils/ranking.py)
+  ## precision=53 makes it a DOUBLE on MySQL: a plain FLOAT there is single precision, so the score written into
+  ## a page cursor wouldn't compare equal to the stored one and the hot feed would repeat or skip posts
+  hot_score = Column(Float(precision=53), nullable=False, default=0, server_default='0')
 
   # define dynamic properties that won't become part of the MySQL table but that the query will return
   # include a dynamic property for user, 
   # meaning that a query for a post should also return information about its author
   user = relationship('User')
   # query for a post should also return comments
-  ### cascade here deletes all associated comments if the post is deleted
-  comments = relationship('Comment', cascade='all,delete')
\ No newline at end of file
+  ### the comments table's foreign key has ON DELETE CASCADE, so the database deletes a post's comments (and votes)
+  ### passive_deletes tells SQLAlchemy to leave that to the database instead of loading every comment to delete it
+  comments = relationship('Comment', cascade='all,delete', passive_deletes=True)
\ No newline at end of file
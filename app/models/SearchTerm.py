@@ -0,0 +1,17 @@
+from app.db import Base
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+
+# the inverted index behind search (see app/utils/search.py)
+# one row per word per post: which posts a word appears in, and how much it counts towards their rank
+## weight adds up every time the word appears: in the title it counts for TITLE_WEIGHT, in a comment for 1
+class SearchTerm(Base):
+  __tablename__ = 'search_terms'
+  # the primary key starts with term, so finding a word (or every word with a prefix) is an index range scan
+  # the post_id index finds a post's words when its title changes, and lets the database cascade a delete
+  __table_args__ = (
+    Index('ix_search_terms_post_id', 'post_id'),
+  )
+  term = Column(String(40), primary_key=True)
+  # ON DELETE CASCADE: the database takes a deleted post out of the index
+  post_id = Column(Integer, ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+  weight = Column(Integer, nullable=False, default=0)
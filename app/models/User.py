@@ -4,12 +4,10 @@ from app.db import Base
 from sqlalchemy import Column, Integer, String
 # import sqlalchemy's validation function to validate email address
 from sqlalchemy.orm import validates
-# import bcrypt to encrypt our user's password information prior to send it to the database
-import bcrypt
-
-# create a salt to hash passwords against
+# import the bcrypt helpers that encrypt our user's password information prior to sending it to the database
+# they run bcrypt on a small worker pool and give every password its own salt
 # salt is random data that is used as an additional input to a one-way function that hashes passwords/data
-salt = bcrypt.gensalt()
+from app.utils.hashing import hash_password, check_password, needs_rehash
 
 # When using SQLAlchemy, we create models as Python classes
 # creates a User class that inherits from the Base class
@@ -41,12 +39,15 @@ class User(Base):
     # make sure the password is longer than 4 characters
     assert len(password) > 4
     # return the encypted password
-    return bcrypt.hashpw(password.encode('utf-8'), salt)
+    # raises HashingBusy if too many passwords are already being hashed
+    return hash_password(password)
 
   # create a verify_password() method for login
-  # uses the checkpw method to compare the incoming password from login to the saved one on the User object
+  # uses check_password to compare the incoming password from login to the saved one on the User object
   def verify_password(self, password):
-    return bcrypt.checkpw(
-      password.encode('utf-8'),
-      self.password.encode('utf-8')
-    )
\ No newline at end of file
+    return check_password(password, self.password)
+
+  # create a password_needs_rehash() method for login
+  # returns True if the saved password was hashed with a different BCRYPT_ROUNDS than the one configured now
+  def password_needs_rehash(self):
+    return needs_rehash(self.password)
\ No newline at end of file
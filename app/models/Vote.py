@@ -1,8 +1,14 @@
 from app.db import Base
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, UniqueConstraint
 
 class Vote(Base):
   __tablename__ = 'votes'
+  # a user can only upvote a post once
+  # post_id comes first so the same index also serves counting a post's votes
+  __table_args__ = (
+    UniqueConstraint('post_id', 'user_id', name='uq_votes_post_user'),
+  )
   id = Column(Integer, primary_key=True)
   user_id = Column(Integer, ForeignKey('users.id'))
-  post_id = Column(Integer, ForeignKey('posts.id'))
\ No newline at end of file
+  # ON DELETE CASCADE: the database deletes a post's votes together with the post
+  post_id = Column(Integer, ForeignKey('posts.id', ondelete='CASCADE'))
\ No newline at end of file
@@ -4,4 +4,5 @@
 from .User import User
 from .Post import Post
 from .Comment import Comment
-from .Vote import Vote
\ No newline at end of file
+from .Vote import Vote
+from .SearchTerm import SearchTerm
\ No newline at end of file
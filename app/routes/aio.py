@@ -0,0 +1,165 @@
+# this file is a "module"
+# this module has the async versions of the read routes in home.py and dashboard.py
+# they run on Quart (Flask's API on asyncio) under an ASGI server, see app/asgi.py
+# every other route (login, the api, static files) is still served by the Flask app
+
+from quart import Blueprint, render_template, session, redirect, request, current_app, abort, make_response, Response
+
+from sqlalchemy import select
+
+from app.models import Post, Comment
+from app.db.aio import get_async_db
+from app.utils.pagination import paginate_async, paginate_oldest_first_async, parse_sort, SORTS
+from app.utils import cache
+from app.utils.conditional import validators, is_fresh, set_validators
+
+# reuse the sync routes' loading strategies, so both versions send the same queries
+## every relationship a template touches has to be in these: an async session can't lazy load
+from app.routes.home import FEED_LOADING, SINGLE_POST_LOADING, COMMENT_LOADING
+from app.routes.dashboard import DASH_LOADING, EDIT_LOADING
+
+from functools import wraps
+
+bp = Blueprint('aio', __name__)
+
+# the async version of login_required() in app/utils/auth.py
+def login_required(func):
+  @wraps(func)
+  async def wrapped_function(*args, **kwargs):
+    if session.get('loggedIn') == True:
+      return await func(*args, **kwargs)
+
+    return redirect('/login')
+
+  return wrapped_function
+
+# the async version of conditional() in app/utils/conditional.py
+## render is an async function that returns the page's HTML
+async def conditional(etag, last_modified, public, render, shared_max_age=0):
+  if is_fresh(etag, last_modified, request):
+    response = Response('', status=304)
+  else:
+    response = await make_response(await render())
+
+  return set_validators(response, etag, last_modified, public, shared_max_age)
+
+# one page of the feed for the sort and page cursor in the query string
+## scalars=False for a statement that selects columns instead of Post
+async def feed_page(db, statement, sort, scalars=True):
+  return await paginate_async(
+    db,
+    statement,
+    Post,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=current_app.config['PAGE_SIZE'],
+    sort_by=SORTS[sort],
+    scalars=scalars
+  )
+
+@bp.route('/')
+async def index():
+  sort = parse_sort(request.args.get('sort'))
+
+  # logged-out visitors share the rendered page cache with the sync route
+  if not session.get('loggedIn'):
+    cached = cache.feed_pages.get(request.full_path)
+    if cached is None:
+      generation = cache.feed_pages.generation()
+      cached = await build_index(sort)
+      cache.feed_pages.set(request.full_path, cached, generation)
+
+    html, etag, last_modified = cached
+
+    async def cached_html():
+      return html
+
+    return await conditional(etag, last_modified, True, cached_html, current_app.config['FEED_CACHE_TTL'])
+
+  # logged-in visitors: read the validator columns first, and only render if the browser's copy is out of date
+  db = await get_async_db()
+  keys = await feed_page(
+    db,
+    select(Post.id, Post.created_at, Post.hot_score, Post.updated_at, Post.vote_count, Post.comment_count),
+    sort,
+    scalars=False
+  )
+  etag, last_modified = validators(keys.items, current_app.config['APP_VERSION'], keys.next_cursor, keys.prev_cursor, sort, True)
+
+  async def page_html():
+    return (await build_index(sort))[0]
+
+  return await conditional(etag, last_modified, False, page_html)
+
+# render the homepage, returning the HTML with its ETag and Last-Modified
+async def build_index(sort):
+  db = await get_async_db()
+  page = await feed_page(db, select(Post).options(*FEED_LOADING), sort)
+  html = await render_template(
+    'homepage.html',
+    posts=page.items,
+    page=page,
+    sort=sort,
+    loggedIn=session.get('loggedIn')
+  )
+  etag, last_modified = validators(page.items, current_app.config['APP_VERSION'], page.next_cursor, page.prev_cursor, sort, bool(session.get('loggedIn')))
+  return html, etag, last_modified
+
+@bp.route('/post/<id>')
+async def single(id):
+  db = await get_async_db()
+  key = (await db.execute(
+    select(Post.id, Post.updated_at, Post.vote_count, Post.comment_count).where(Post.id == id)
+  )).first()
+  if key is None:
+    abort(404)
+
+  logged_in = bool(session.get('loggedIn'))
+  etag, last_modified = validators([key], current_app.config['APP_VERSION'], logged_in, dated=True)
+
+  async def page_html():
+    post = (await db.execute(select(Post).options(*SINGLE_POST_LOADING).where(Post.id == id))).scalar_one()
+    comments = await paginate_oldest_first_async(
+      db,
+      select(Comment).options(*COMMENT_LOADING).where(Comment.post_id == post.id),
+      Comment,
+      page_size=current_app.config['COMMENT_PAGE_SIZE']
+    )
+    return await render_template(
+      'single-post.html',
+      post=post,
+      comments=comments,
+      loggedIn=session.get('loggedIn')
+    )
+
+  return await conditional(etag, last_modified, not logged_in, page_html, current_app.config['FEED_CACHE_TTL'])
+
+@bp.route('/dashboard')
+@login_required
+async def dash():
+  db = await get_async_db()
+  page = await paginate_async(
+    db,
+    select(Post).options(*DASH_LOADING).where(Post.user_id == session.get('user_id')),
+    Post,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=current_app.config['PAGE_SIZE']
+  )
+  return await render_template(
+    'dashboard.html',
+    posts=page.items,
+    page=page,
+    loggedIn=session.get('loggedIn')
+  )
+
+@bp.route('/dashboard/edit/<id>')
+@login_required
+async def edit(id):
+  db = await get_async_db()
+  post = (await db.execute(select(Post).options(*EDIT_LOADING).where(Post.id == id))).scalar_one()
+  return await render_template(
+    'edit-post.html',
+    post=post,
+    loggedIn=session.get('loggedIn')
+  )
@@ -4,19 +4,56 @@
 # request object is a global contextual object that contains information about the request
 # jsonify returns back JSON notation
 # session is similar to express-session npm package where we can have the app keep track of user's logged-in status
-from flask import Blueprint, request, jsonify, session
+# Response and stream_with_context let us send a large JSON page in pieces as it is serialized
+# current_app gives us the page size from the app config
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context, current_app
 
-from app.models import User, Post, Comment, Vote
+# json turns each serialized post into a string for the streamed response
+import json
+
+# joinedload and selectinload load the authors (and comments) with the posts instead of one query per row
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.models import User, Post, Comment
 
 # bring in the function for use
-from app.db import get_db
+from app.db import get_db, get_engine, get_replicas
+from app.db.pool import pool_stats
 
 # sys module allows us to see error messages
 import sys
 
+# datetime gives a new post's age for its first hot score
+from datetime import datetime
+
 # import the auth decorator
 from app.utils.auth import login_required
 
+# import the rendered HTML caches so writes can throw away anything they made stale
+from app.utils import cache
+
+# import the upvote writer that skips duplicate votes
+from app.utils import votes
+
+# import the hot ranking so new posts and comments update a post's score
+from app.utils import ranking
+
+# import the search index so every write keeps it up to date
+from app.utils import search
+
+# import the URL parsing that stores each post's domain
+from app.utils import domains
+
+# import the error the password hashing pool raises when it is too busy
+from app.utils.hashing import HashingBusy
+
+# import the keyset pagination helper and the JSON serializers for the read routes
+from app.utils.pagination import paginate, parse_sort, SORTS
+from app.utils import serializers
+
+# the single post page's comment paging, so the api pages comments the same way
+from app.routes.home import post_comments
+
 # create the api blueprint
 bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -60,6 +97,11 @@ def signup():
     ## update the database
     db.commit()
 
+  ## if too many passwords are being hashed right now, ask the client to try again shortly
+  except HashingBusy:
+    db.rollback()
+    return jsonify(message = 'Too many requests, try again shortly'), 503, {'Retry-After': '1'}
+
   ## if insertion fails, send an error to the front end 
   ### currently User model has error handling but we need to pass it to the front end as something understandable to the user
   ### send back a message and status code 500 to indicate that a server error occurred
@@ -113,9 +155,20 @@ def login():
   # step 2, once email is valid, is to check password
   ## we use the verify_password method we wrote as part of the User model
   ## the incoming data['password'] is actually the second parameter of the verify_password method
-  if user.verify_password(data['password']) == False:
-    # tell the user there was a problem and return 400 status code
-    return jsonify(message = 'Incorrect credentials'), 400
+  try:
+    if user.verify_password(data['password']) == False:
+      # tell the user there was a problem and return 400 status code
+      return jsonify(message = 'Incorrect credentials'), 400
+
+    # step 3, if BCRYPT_ROUNDS changed since this password was saved, hash it again with the new work factor
+    ## we know the plain password is correct right now, so this is the only chance to do it
+    if user.password_needs_rehash():
+      user.password = data['password']
+      db.commit()
+  ## if too many passwords are being hashed right now, ask the client to try again shortly
+  except HashingBusy:
+    db.rollback()
+    return jsonify(message = 'Too many requests, try again shortly'), 503, {'Retry-After': '1'}
 
   # this clears any existing session data then
   # creates two new session properties:
@@ -151,7 +204,21 @@ def comment():
     # save in database
     ## prep the INSERT statement
     db.add(newComment)
-    # perform the INSERT against the database
+    # send the INSERT to the database without committing yet
+    ## the post's stored comment_count is bumped in the same transaction (see app/utils/counters.py)
+    db.flush()
+    # a new comment raises the post's hot score
+    ranking.refresh_scores(db.connection(), [newComment.post_id])
+    # and makes the post findable by the comment's words
+    search.index_comment(db.connection(), newComment.post_id, newComment.comment_text)
+    # the page adds the new comment in place, so send it back with the post's new comment count
+    ## read them before the commit, which would expire the comment and make us load it again
+    body = dict(
+      id = newComment.id,
+      comment = serializers.serialize_comment(newComment),
+      comment_count = db.query(Post.comment_count).filter(Post.id == newComment.post_id).scalar()
+    )
+    # commit the comment, counter and score together
     db.commit()
 
   except:
@@ -162,8 +229,11 @@ def comment():
     # return a message
     return jsonify(message = 'Comment failed'), 500
 
-  # if the commit is successful, return the the newly created comment ID
-  return jsonify(id = newComment.id)
+  # the post's comment count changed, so its cached card and the cached feed pages are stale
+  cache.invalidate_post(data['post_id'])
+
+  # if the commit is successful, return the the newly created comment ID, the comment and the post's comment count
+  return jsonify(body)
 
 ## upvote creates a new record in the votes table but the Post model uses the information
 @bp.route('/posts/upvote', methods=['PUT'])
@@ -176,16 +246,26 @@ def upvote():
 
   # use try/except in case creation of upvote data fails
   try:
-    # create a new vote with incoming id and session id
-    newVote = Vote(
-      post_id = data['post_id'],
-      user_id = session.get('user_id')
-    )
-
-    # save in database
-    ## prep the INSERT statement
-    db.add(newVote)
-    # perform the INSERT against the database
+    # votes come in as the post id from the URL, so make sure it is a number before we store it
+    post_id = int(data['post_id'])
+
+    # a vote for a post that doesn't exist (or was just deleted) is a 404
+    ## check first, because MySQL's INSERT IGNORE turns the foreign key failure into a warning and skips the row
+    if db.query(Post.id).filter(Post.id == post_id).first() is None:
+      return jsonify(message = 'Post not found'), 404
+
+    # in write-behind mode, queue the vote and let the background thread write it with the others
+    ## 202 means the vote was accepted but isn't saved yet, so there is no new vote count to send back
+    if votes.buffer.running:
+      votes.buffer.add(post_id, session.get('user_id'))
+      return jsonify(post_id = post_id, queued = True), 202
+
+    # insert the vote with incoming id and session id
+    ## INSERT IGNORE skips the vote if this user already upvoted the post, so clicking twice is harmless
+    ## the post's stored vote_count is only bumped if the vote was new, in the same transaction
+    new_votes = votes.record_votes(db.connection(), [(post_id, session.get('user_id'))])
+    # the page updates the count in place, so send back the post's new vote count
+    vote_count = db.query(Post.vote_count).filter(Post.id == post_id).scalar()
     db.commit()
 
   except:
@@ -196,8 +276,13 @@ def upvote():
     # return a message
     return jsonify(message = 'Upvote failed'), 500
 
-  # if the commit is successful, return 
-  return '', 204
+  # the post's vote count changed, so its cached card and the cached feed pages are stale
+  if new_votes:
+    cache.invalidate_post(post_id)
+
+  # if the commit is successful, return the post's vote count
+  ## voted is False if this user had already upvoted the post
+  return jsonify(post_id = post_id, vote_count = vote_count, voted = bool(new_votes))
 
 # route to create a new post
 @bp.route('/posts', methods=['POST'])
@@ -212,10 +297,17 @@ def create():
     newPost = Post(
       title = data['title'],
       post_url = data['post_url'],
-      user_id = session.get('user_id')
+      # store the domain now, so the post card and the /from/<domain> feed don't have to parse the URL
+      domain = domains.url_domain(data['post_url']),
+      user_id = session.get('user_id'),
+      # a brand new post starts with the score of a post with no votes or comments
+      hot_score = ranking.hot_score(0, 0, datetime.now())
     )
 
     db.add(newPost)
+    # send the INSERT first so the post has an id for the search index
+    db.flush()
+    search.index_post(db.connection(), newPost.id, newPost.title)
     db.commit()
   except:
     print(sys.exc_info()[0])
@@ -223,6 +315,9 @@ def create():
     db.rollback()
     return jsonify(message = 'Post failed'), 500
 
+  # the new post belongs on the first page of the feed
+  cache.invalidate_feed()
+
   return jsonify(id = newPost.id)
 
 # update the details of a post
@@ -238,8 +333,13 @@ def update(id):
   try:
     # SQLAlchemy requires query of the database for the corresponding record
     post = db.query(Post).filter(Post.id == id).one()
+    # swap the old title's words for the new one's in the search index
+    search.reindex_title(db.connection(), post.id, post.title, data['title'])
     # then update the record like you'd update a normal dictionary
     post.title = data['title']
+    # a post written before posts.domain was added gets its domain now
+    if post.domain is None:
+      post.domain = domains.url_domain(post.post_url)
     # then recommit it
     db.commit()
 
@@ -248,9 +348,30 @@ def update(id):
 
     db.rollback()
     return jsonify(message = 'Post not found'), 404
+
+  # the title changed, so the cached card and the cached feed pages are stale
+  cache.invalidate_post(id)
   
   return '', 204
 
+# the most posts one bulk delete can remove
+MAX_BULK_DELETE = 500
+
+# delete posts that belong to user_id, in the caller's transaction, without loading any Post objects
+# the foreign keys delete their comments, votes and search terms (ON DELETE CASCADE)
+# returns the ids that were deleted, or None (and deletes nothing) if any id isn't one of the user's posts
+def delete_posts(db, ids, user_id):
+  ids = set(ids)
+  owned = set(
+    row.id for row in db.query(Post.id).filter(Post.id.in_(ids), Post.user_id == user_id)
+  )
+  if owned != ids:
+    return None
+
+  # synchronize_session=False: there are no Post objects in the session to keep in step
+  db.query(Post).filter(Post.id.in_(owned)).delete(synchronize_session=False)
+  return owned
+
 # delete a post
 # use an <id> route parameter 
 @bp.route('/posts/<id>', methods=['DELETE'])
@@ -261,9 +382,10 @@ def delete(id):
   db = get_db()
 
   try:
-    # SQLAlchemy requires query of the database for the corresponding record
-    # then pass the data to db.delete to delete post from db
-    db.delete(db.query(Post).filter(Post.id == id).one())
+    # delete the post straight from the table, as long as it is the logged-in user's
+    deleted = delete_posts(db, [int(id)], session.get('user_id'))
+    if deleted is None:
+      return jsonify(message = 'Post not found'), 404
     # commit the change
     db.commit()
   except:
@@ -272,4 +394,212 @@ def delete(id):
     db.rollback()
     return jsonify(message = 'Post not found'), 404
 
-  return '', 204
\ No newline at end of file
+  # don't keep a card or feed page showing a post that no longer exists
+  cache.invalidate_post(id)
+
+  return '', 204
+
+# delete many posts at once, i.e. from the checkboxes on the dashboard
+# send the ids as JSON: {"ids": [1, 2, 3]}
+# either every post is deleted (in one transaction) or, if any of them isn't the user's, none are
+@bp.route('/posts', methods=['DELETE'])
+# add auth decorator
+@login_required
+def bulk_delete():
+  data = request.get_json(silent=True) or {}
+
+  try:
+    ids = [int(id) for id in data['ids']]
+  except (KeyError, TypeError, ValueError):
+    return jsonify(message = 'Send the post ids to delete as {"ids": [...]}'), 400
+  if not ids or len(ids) > MAX_BULK_DELETE:
+    return jsonify(message = 'Send between 1 and {} post ids'.format(MAX_BULK_DELETE)), 400
+
+  db = get_db()
+
+  try:
+    deleted = delete_posts(db, ids, session.get('user_id'))
+    if deleted is None:
+      return jsonify(message = 'You can only delete your own posts'), 403
+    db.commit()
+  except:
+    print(sys.exc_info()[0])
+
+    db.rollback()
+    return jsonify(message = 'Delete failed'), 500
+
+  for id in deleted:
+    cache.invalidate_post(id)
+
+  return jsonify(deleted = sorted(deleted))
+
+# the read routes below let the mobile client and integrations read posts as JSON
+# both answer with a strong ETag built from cheap columns (id, updated_at and the counters),
+# so a client that sends it back in If-None-Match gets a 304 before any post is loaded or serialized
+
+# read the query parameters the read routes share
+## ?fields=id,title picks the post fields, ?include=comments adds each post's comments
+def read_options():
+  fields = serializers.parse_fields(request.args.get('fields'))
+  include_comments = 'comments' in request.args.get('include', '').split(',')
+  return fields, include_comments
+
+# the loading strategy for the posts a read route serializes
+def post_loading(include_comments):
+  options = [joinedload(Post.user)]
+  if include_comments:
+    options.append(selectinload(Post.comments).joinedload(Comment.user))
+  return options
+
+# the response for a client whose copy is still current
+def not_modified(etag):
+  response = Response(status=304)
+  response.set_etag(etag)
+  return response
+
+# this route resolves to /api/posts and is a GET route
+# ?sort=hot, ?before= and ?after= page through posts just like the homepage, ?limit= sets the page size
+@bp.route('/posts', methods=['GET'])
+def list_posts():
+  try:
+    fields, include_comments = read_options()
+  except ValueError as e:
+    return jsonify(message = str(e)), 400
+
+  sort = parse_sort(request.args.get('sort'))
+  db = get_db()
+
+  # step 1, page through just the columns the ETag needs
+  keys = paginate(
+    db.query(Post.id, Post.created_at, Post.hot_score, Post.updated_at, Post.vote_count, Post.comment_count),
+    Post,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=request.args.get('limit', type=int) or current_app.config['PAGE_SIZE'],
+    sort_by=SORTS[sort]
+  )
+  etag = serializers.make_etag(
+    [(row.id, row.updated_at, row.vote_count, row.comment_count) for row in keys.items],
+    keys.next_cursor, keys.prev_cursor, fields, include_comments, current_app.config['APP_VERSION']
+  )
+  if request.if_none_match.contains(etag):
+    return not_modified(etag)
+
+  # step 2, load the full posts on the page (and their authors, and comments if asked for) in one go
+  ids = [row.id for row in keys.items]
+  posts = {
+    post.id: post
+    for post in db.query(Post).options(*post_loading(include_comments)).filter(Post.id.in_(ids))
+  }
+
+  # step 3, stream the page one post at a time, so a large page doesn't have to be built in memory first
+  def generate():
+    yield '{"posts": ['
+    separator = ''
+    for id in ids:
+      # skip a post deleted between step 1 and step 2
+      if id in posts:
+        yield separator + json.dumps(serializers.serialize_post(posts[id], fields, include_comments))
+        separator = ', '
+    yield '], "next_cursor": {}, "prev_cursor": {}}}'.format(
+      json.dumps(keys.next_cursor), json.dumps(keys.prev_cursor)
+    )
+
+  response = Response(stream_with_context(generate()), mimetype='application/json')
+  response.set_etag(etag)
+  # clients may keep the page, but must check with us (cheaply, via the ETag) before using it again
+  response.headers['Cache-Control'] = 'no-cache'
+  return response
+
+# this route resolves to /api/posts/<id> and is a GET route
+@bp.route('/posts/<id>', methods=['GET'])
+def get_post(id):
+  try:
+    fields, include_comments = read_options()
+  except ValueError as e:
+    return jsonify(message = str(e)), 400
+
+  db = get_db()
+
+  # step 1, read just the columns the ETag needs
+  key = (
+    db.query(Post.id, Post.updated_at, Post.vote_count, Post.comment_count)
+    .filter(Post.id == id)
+    .first()
+  )
+  if key is None:
+    return jsonify(message = 'Post not found'), 404
+
+  etag = serializers.make_etag(tuple(key), fields, include_comments, current_app.config['APP_VERSION'])
+  if request.if_none_match.contains(etag):
+    return not_modified(etag)
+
+  # step 2, load and serialize the post
+  post = db.query(Post).options(*post_loading(include_comments)).filter(Post.id == id).one()
+  response = jsonify(serializers.serialize_post(post, fields, include_comments))
+  response.set_etag(etag)
+  response.headers['Cache-Control'] = 'no-cache'
+  return response
+
+# this route resolves to /api/posts/<id>/comments and is a GET route
+# the single post page only renders the first page of comments, its load more button calls this for the rest
+## ?cursor= is the next_cursor from the page before, oldest comments come first
+@bp.route('/posts/<id>/comments', methods=['GET'])
+def list_comments(id):
+  db = get_db()
+
+  # an empty page could mean the post doesn't exist, so check first (a primary key lookup)
+  if db.query(Post.id).filter(Post.id == id).first() is None:
+    return jsonify(message = 'Post not found'), 404
+
+  page = post_comments(db, id, request.args.get('cursor'))
+  return jsonify(
+    comments = [serializers.serialize_comment(comment) for comment in page.items],
+    next_cursor = page.next_cursor
+  )
+
+# this route resolves to /api/search and is a GET route
+# ?q= is the search, where a word ending in * matches every word that starts with it
+# ?before= and ?after= page through the results, best match first
+@bp.route('/search', methods=['GET'])
+def search_posts():
+  try:
+    fields, include_comments = read_options()
+  except ValueError as e:
+    return jsonify(message = str(e)), 400
+
+  db = get_db()
+  page = search.search(
+    db,
+    request.args.get('q'),
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=request.args.get('limit', type=int) or current_app.config['PAGE_SIZE']
+  )
+  if page is None:
+    return jsonify(posts = [], next_cursor = None, prev_cursor = None)
+
+  # load the posts on the page in one query and put them back in rank order
+  posts = search.load_posts(db, page, post_loading(include_comments))
+  return jsonify(
+    posts = [serializers.serialize_post(post, fields, include_comments) for post in posts],
+    next_cursor = page.next_cursor,
+    prev_cursor = page.prev_cursor
+  )
+
+# report how well the in-process caches and the connection pool are working for this worker
+# use the hit/miss numbers to decide whether POST_CARD_CACHE_SIZE needs to grow,
+# and the pool wait times to decide whether DB_POOL_SIZE does
+# replicas shows how far behind the primary each read replica was at the last check
+# these are internals, so the route answers 404 unless STATS_ENDPOINT is turned on in the app config
+@bp.route('/stats', methods=['GET'])
+def stats():
+  if not current_app.config['STATS_ENDPOINT']:
+    return jsonify(message = 'Not found'), 404
+
+  return jsonify(
+    post_cards = cache.post_cards.stats(),
+    feed_pages = cache.feed_pages.stats(),
+    pool = pool_stats.snapshot(get_engine().pool),
+    replicas = get_replicas().stats()
+  )
\ No newline at end of file
@@ -1,8 +1,12 @@
 # this file is a "module"
 # this module is for the dashboard routes
-from flask import Blueprint, render_template, session
-from app.models import Post
-from app.db import get_db
+from flask import Blueprint, render_template, session, request, current_app
+from app.models import Post, Comment
+from app.db import get_db, read_from_replica
+# joinedload and selectinload let us load related rows up front instead of one query per row
+from sqlalchemy.orm import joinedload, selectinload
+# import the keyset pagination helper
+from app.utils.pagination import paginate
 
 # import the auth decorator
 from app.utils.auth import login_required
@@ -15,6 +19,14 @@ from flask import Blueprint, render_template
 
 # using the url_prefix argument, we prefix every route in the blueprint with /dashboard
 bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
+# these pages only read, so their GET requests may be served by a read replica (see app/db/replicas.py)
+bp.before_request(read_from_replica)
+
+# loading strategies for the related rows each template touches
+## the dashboard list shows each post's author, so join the users table into the same query
+DASH_LOADING = [joinedload(Post.user)]
+## the edit page lists every comment and its author, so load them in one extra IN (...) query
+EDIT_LOADING = [selectinload(Post.comments).joinedload(Comment.user)]
 
 # due to prefix, this route is /dashboard
 @bp.route('/')
@@ -23,16 +35,18 @@ bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 def dash():
   db = get_db()
   # query the database for the corresponding record by user_id
-  # order in descending order
-  posts = (
-    db.query(Post)
-    .filter(Post.user_id == session.get('user_id'))
-    .order_by(Post.created_at.desc())
-    .all()
+  # paginate() orders them in descending order and only loads one page
+  page = paginate(
+    db.query(Post).options(*DASH_LOADING).filter(Post.user_id == session.get('user_id')),
+    Post,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=current_app.config['PAGE_SIZE']
   )
   return render_template(
     'dashboard.html',
-    posts=posts,
+    posts=page.items,
+    page=page,
     loggedIn=session.get('loggedIn')
   )
 
@@ -43,7 +57,7 @@ def dash():
 def edit(id):
   # get single post by id
   db = get_db()
-  post = db.query(Post).filter(Post.id == id).one()
+  post = db.query(Post).options(*EDIT_LOADING).filter(Post.id == id).one()
   return render_template(
     'edit-post.html',
     post=post,
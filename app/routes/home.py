@@ -6,34 +6,145 @@
 ## render_template allows us to return a template (similar to handlebars)
 ## session allows us to keep track of whether user is logged in
 ## redirect will redirect to a different path
-from flask import Blueprint, render_template, session, redirect
+## abort ends the request with an error page, i.e. a 404 for a post that doesn't exist
+## request lets us read the page cursor from the query string
+## current_app gives us the page size from the app config
+from flask import Blueprint, render_template, session, redirect, request, current_app, abort
 
-# import Post model
-from app.models import Post
+# import Post and Comment models
+from app.models import Post, Comment
+# joinedload lets us load related rows up front instead of one query per row
+from sqlalchemy.orm import joinedload
 # import function that returns the session-connection object
-from app.db import get_db
+from app.db import get_db, read_from_replica
+# import the keyset pagination helper
+from app.utils.pagination import paginate, paginate_oldest_first, parse_sort, SORTS
+# import the rendered page cache for logged-out visitors
+from app.utils import cache
+# import the full-text search
+from app.utils import search
+# import the URL parsing that stores each post's domain
+from app.utils.domains import url_domain
+# import the HTTP conditional request helpers
+from app.utils.conditional import validators, conditional
 
 # consolidate routes onto a single bp object
 bp = Blueprint('home', __name__, url_prefix='/')
+# these pages only read, so their GET requests may be served by a read replica (see app/db/replicas.py)
+bp.before_request(read_from_replica)
+
+# loading strategies for the related rows each template touches
+## the homepage only shows each post's author, so join the users table into the same query
+FEED_LOADING = [joinedload(Post.user)]
+## the single post page only loads the post and its author up front,
+## its comments are paged separately (see post_comments()) so a post with thousands of them stays cheap
+SINGLE_POST_LOADING = [joinedload(Post.user)]
+## each comment shows its author, so join the users table into the comment query
+COMMENT_LOADING = [joinedload(Comment.user)]
 
 # add a @bp.route() decorator before the function to turn it into a route
 @bp.route('/')
 def index():
+  # ?sort=hot shows the hot feed, anything else shows the newest posts
+  sort = parse_sort(request.args.get('sort'))
+
+  # logged-out visitors all see the same page, so reuse a copy rendered in the last few seconds
+  # the cache key includes the query string, so every page cursor is cached separately
+  # the cached copy keeps its ETag and Last-Modified next to the HTML, so a 304 here costs no queries at all
+  # the page has no session-dependent content, so shared proxies may keep it for as long as we do
+  if not session.get('loggedIn'):
+    html, etag, last_modified = cache.feed_pages.get_or_build(request.full_path, lambda: build_index(sort))
+    return conditional(etag, last_modified, True, lambda: html, current_app.config['FEED_CACHE_TTL'])
+
+  # logged-in visitors: read just the columns the validators need,
+  # and only load and render the full page if the browser's copy is out of date
+  db = get_db()
+  keys = feed_page(
+    db.query(Post.id, Post.created_at, Post.hot_score, Post.updated_at, Post.vote_count, Post.comment_count),
+    sort
+  )
+  etag, last_modified = validators(keys.items, current_app.config['APP_VERSION'], keys.next_cursor, keys.prev_cursor, sort, True)
+  return conditional(etag, last_modified, False, lambda: build_index(sort)[0])
+
+# one page of the feed for the sort and page cursor in the query string
+# paginate() orders the posts by the sort column and only loads one page of them,
+# starting after the ?before= or ?after= cursor if the user clicked next or previous
+def feed_page(query, sort):
+  return paginate(
+    query,
+    Post,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=current_app.config['PAGE_SIZE'],
+    sort_by=SORTS[sort]
+  )
+
+# render the homepage, returning the HTML with its ETag and Last-Modified
+def build_index(sort):
   # save returned session connection that's tied to this route's context to db variable
   db = get_db()
-  # then we use the query() method on the connection object to query the Post model for all posts
-  # in descending order
-  # save to posts variable
-  # get all posts
-  posts = db.query(Post).order_by(Post.created_at.desc()).all()
+  # then we use the query() method on the connection object to query the Post model
+  page = feed_page(db.query(Post).options(*FEED_LOADING), sort)
   # return a template rather than the string homepage.html
-  # with posts data
+  # with posts data and the page for the next/previous links
   # pass in the loggedIn session
-  return render_template(
+  html = render_template(
     'homepage.html',
-    posts=posts,
+    posts=page.items,
+    page=page,
+    sort=sort,
+    loggedIn=session.get('loggedIn')
+  )
+  etag, last_modified = validators(page.items, current_app.config['APP_VERSION'], page.next_cursor, page.prev_cursor, sort, bool(session.get('loggedIn')))
+  return html, etag, last_modified
+
+# add a @bp.route() decorator before the function to turn it into a route
+# ?q= is the search, where a word ending in * matches every word that starts with it
+@bp.route('/search')
+def search_page():
+  q = request.args.get('q', '').strip()
+  db = get_db()
+  # look the words up in the search index (see app/utils/search.py), best match first
+  page = search.search(
+    db,
+    q,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=current_app.config['PAGE_SIZE']
+  )
+  return render_template(
+    'search.html',
+    q=q,
+    posts=search.load_posts(db, page, FEED_LOADING) if page else [],
+    page=page,
     loggedIn=session.get('loggedIn')
-)
+  )
+
+# add a @bp.route() decorator before the function to turn it into a route
+# every post that links to the same site, newest first, i.e. /from/example.com
+# posts.domain is stored when a post is written and indexed with created_at, so this is one index range scan
+@bp.route('/from/<domain>')
+def from_domain(domain):
+  # normalize the domain the same way the stored ones are, so /from/www.Example.com finds example.com
+  domain = url_domain(domain)
+  if domain is None:
+    abort(404)
+
+  db = get_db()
+  page = paginate(
+    db.query(Post).options(*FEED_LOADING).filter(Post.domain == domain),
+    Post,
+    before=request.args.get('before'),
+    after=request.args.get('after'),
+    page_size=current_app.config['PAGE_SIZE']
+  )
+  return render_template(
+    'domain.html',
+    domain=domain,
+    posts=page.items,
+    page=page,
+    loggedIn=session.get('loggedIn')
+  )
 
 # add a @bp.route() decorator before the function to turn it into a route
 @bp.route('/login')
@@ -51,17 +162,50 @@ def login():
 # to capture it, we include it as a function parameter
 def single(id):
   # save returned session connection that's tied to this route's context to db variable
+  db = get_db()
+  # read just the columns the ETag and Last-Modified need
+  # a new comment or vote changes the post's counters, so these are enough to tell whether the page changed
+  key = (
+    db.query(Post.id, Post.updated_at, Post.vote_count, Post.comment_count)
+    .filter(Post.id == id)
+    .first()
+  )
+  if key is None:
+    abort(404)
+
+  # logged-in visitors get the comment and upvote forms, so only the logged-out page may go in a shared cache
+  logged_in = bool(session.get('loggedIn'))
+  etag, last_modified = validators([key], current_app.config['APP_VERSION'], logged_in, dated=True)
+  return conditional(
+    etag, last_modified, not logged_in, lambda: render_single(id), current_app.config['FEED_CACHE_TTL']
+  )
+
+# render the single post page
+def render_single(id):
   db = get_db()
   # get single post by id
   # use the filter() method on the connection object to specify the SQL WHERE clause
-  post = db.query(Post).filter(Post.id == id).one()
+  post = db.query(Post).options(*SINGLE_POST_LOADING).filter(Post.id == id).one()
+  # only the first page of comments is rendered, the load more button fetches the rest from the api
+  comments = post_comments(db, post.id)
   # return a template rather than the string single-post.html
-  # pass the single post object to the single-post.html template
+  # pass the single post object and its first comments to the single-post.html template
   # Once the template is rendered and the response sent, 
   # the context for this route terminates, and the teardown function closes the database connection
   # (defined by init_db(app) function in app/db/__init__.py)
   return render_template(
     'single-post.html',
     post=post,
+    comments=comments,
     loggedIn=session.get('loggedIn')
-  )
\ No newline at end of file
+  )
+
+# one page of a post's comments, oldest first, starting after the comment in the cursor
+# used by the single post page and by GET /api/posts/<id>/comments
+def post_comments(db, post_id, cursor=None):
+  return paginate_oldest_first(
+    db.query(Comment).options(*COMMENT_LOADING).filter(Comment.post_id == post_id),
+    Comment,
+    cursor=cursor,
+    page_size=current_app.config['COMMENT_PAGE_SIZE']
+  )
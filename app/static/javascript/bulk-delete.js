@@ -0,0 +1,45 @@
+// the posts ticked on the dashboard
+function selectedPosts() {
+  return Array.from(document.querySelectorAll('.select-post:checked'));
+}
+
+// only allow delete selected when something is ticked
+function selectionChangeHandler() {
+  document.querySelector('.delete-selected-btn').disabled = selectedPosts().length === 0;
+}
+
+async function deleteSelectedHandler(event) {
+  event.preventDefault();
+
+  const checkboxes = selectedPosts();
+  if (!checkboxes.length || !confirm(`Delete ${checkboxes.length} ${checkboxes.length === 1 ? 'post' : 'posts'}?`)) {
+    return;
+  }
+
+  // one request deletes all of them in a single transaction
+  const response = await fetch('/api/posts', {
+    method: 'DELETE',
+    body: JSON.stringify({
+      ids: checkboxes.map((checkbox) => parseInt(checkbox.value, 10))
+    }),
+    headers: {
+      'Content-Type': 'application/json'
+    }
+  });
+
+  if (response.ok) {
+    // take the deleted posts off the page instead of reloading it
+    checkboxes.forEach((checkbox) => checkbox.closest('li').remove());
+    selectionChangeHandler();
+  } else {
+    alert(response.statusText);
+  }
+}
+
+const deleteSelectedButton = document.querySelector('.delete-selected-btn');
+if (deleteSelectedButton) {
+  document.querySelectorAll('.select-post').forEach((checkbox) => {
+    checkbox.addEventListener('change', selectionChangeHandler);
+  });
+  deleteSelectedButton.addEventListener('click', deleteSelectedHandler);
+}
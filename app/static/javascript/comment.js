@@ -1,7 +1,8 @@
 async function commentFormHandler(event) {
   event.preventDefault();
 
-  const comment_text = document.querySelector('textarea[name="comment-body"]').value.trim();
+  const textarea = document.querySelector('textarea[name="comment-body"]');
+  const comment_text = textarea.value.trim();
   const post_id = window.location.toString().split('/')[
     window.location.toString().split('/').length - 1
   ];
@@ -19,7 +20,17 @@ async function commentFormHandler(event) {
     });
 
     if (response.ok) {
-      document.location.reload();
+      // the api sends back the new comment and the post's comment count,
+      // so add the comment to the list instead of reloading the whole page
+      const data = await response.json();
+      // while there are comments left to load, the new one belongs after them,
+      // and the load more button will fetch it with the last page, so only the count changes
+      if (!document.querySelector('.load-comments')) {
+        document.querySelector('.comments').append(renderComment(data.comment));
+      }
+      document.querySelector('.comment-count').textContent =
+        `${data.comment_count} ${data.comment_count === 1 ? 'comment' : 'comments'}`;
+      textarea.value = '';
     } else {
       alert(response.statusText);
     }
@@ -0,0 +1,56 @@
+// format a date the same way the format_date filter does, i.e. 03/01/21
+function formatDate(isoDate) {
+  const date = new Date(isoDate);
+  const pad = (number) => String(number).padStart(2, '0');
+
+  return `${pad(date.getMonth() + 1)}/${pad(date.getDate())}/${pad(date.getFullYear() % 100)}`;
+}
+
+// build the same markup as partials/comments.html for a comment from the api
+// textContent (not innerHTML) keeps a comment's text from being run as HTML
+function renderComment(comment) {
+  const section = document.createElement('section');
+  section.className = 'comment';
+
+  const meta = document.createElement('div');
+  meta.className = 'meta';
+  meta.textContent = `${comment.username} on ${formatDate(comment.created_at)}`;
+
+  const text = document.createElement('div');
+  text.className = 'text';
+  text.textContent = comment.comment_text;
+
+  section.append(meta, text);
+  return section;
+}
+
+async function loadCommentsHandler(event) {
+  const button = event.target;
+  button.disabled = true;
+
+  const response = await fetch(
+    `/api/posts/${button.dataset.postId}/comments?cursor=${encodeURIComponent(button.dataset.cursor)}`
+  );
+
+  if (response.ok) {
+    const page = await response.json();
+    const list = document.querySelector('.comments');
+    page.comments.forEach((comment) => list.append(renderComment(comment)));
+
+    // hide the button once there is nothing left to load
+    if (page.next_cursor) {
+      button.dataset.cursor = page.next_cursor;
+      button.disabled = false;
+    } else {
+      button.remove();
+    }
+  } else {
+    button.disabled = false;
+    alert(response.statusText);
+  }
+}
+
+const loadCommentsButton = document.querySelector('.load-comments');
+if (loadCommentsButton) {
+  loadCommentsButton.addEventListener('click', loadCommentsHandler);
+}
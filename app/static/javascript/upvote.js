@@ -1,3 +1,7 @@
+function showVoteCount(count) {
+  document.querySelector('.vote-count').textContent = `${count} ${count === 1 ? 'point' : 'points'}`;
+}
+
 async function upvoteClickHandler(event) {
   event.preventDefault();
 
@@ -14,8 +18,15 @@ async function upvoteClickHandler(event) {
     }
   });
 
-  if (response.ok) {
-    document.location.reload();
+  if (response.status === 202) {
+    // the vote was queued (write-behind mode), so count it here until the next page load
+    showVoteCount(parseInt(document.querySelector('.vote-count').textContent, 10) + 1);
+    event.target.disabled = true;
+  } else if (response.ok) {
+    // the api sends back the post's new vote count, so update it instead of reloading the whole page
+    const data = await response.json();
+    showVoteCount(data.vote_count);
+    event.target.disabled = true;
   } else {
     alert(response.statusText);
   }
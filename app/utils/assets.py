@@ -0,0 +1,144 @@
+# build and serve the CSS and JavaScript in app/static
+# flask build-assets minifies every asset, puts a hash of its contents in the file name
+# and writes a gzip (.gz) and brotli (.br) copy next to it in app/static/dist/,
+# with a manifest.json that maps each original path to its hashed one
+# templates call asset_url('javascript/upvote.js') to get the hashed URL, i.e. /dist/javascript/upvote.1a2b3c4d.js
+# a hashed file never changes, so browsers can cache it for a year without asking again,
+# and a new build gives the changed files new names
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from mimetypes import guess_type
+
+from flask import request, send_file, abort
+# safe_join refuses paths like ../../etc/passwd that would leave the dist folder
+from werkzeug.security import safe_join
+
+# brotli is optional: without it the build only writes .gz copies
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# the file types the build handles, everything else in app/static is left alone
+ASSET_EXTENSIONS = ('.css', '.js')
+# the folder (inside app/static) the build writes to, and the URL prefix it is served from
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# how many hex characters of the content hash go into the file name
+HASH_LENGTH = 8
+# a year, the longest max-age browsers honour
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# precompressed copies, best first, as (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# a conservative CSS minifier: drop comments and the whitespace around punctuation
+def minify_css(text):
+  text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+  text = re.sub(r'\s+', ' ', text)
+  text = re.sub(r'\s*([{}:;,>])\s*', r'\1', text)
+  return text.replace(';}', '}').strip()
+
+# a conservative JavaScript minifier: drop whole-line comments, indentation and blank lines
+# line breaks are kept, so code that leaves out semicolons still works
+def minify_js(text):
+  lines = []
+  for line in text.splitlines():
+    line = line.strip()
+    if line and not line.startswith('//'):
+      lines.append(line)
+  return '\n'.join(lines) + '\n'
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+# the hashed name for a path, i.e. javascript/upvote.js -> javascript/upvote.1a2b3c4d.js
+def hashed_name(path, content):
+  digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+  base, extension = os.path.splitext(path)
+  return '{}.{}{}'.format(base, digest, extension)
+
+def write(path, content):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'wb') as f:
+    f.write(content)
+
+# build every asset in static_folder into static_folder/dist and return the manifest
+def build(static_folder):
+  dist = os.path.join(static_folder, DIST_DIR)
+  manifest = {}
+
+  for root, dirs, files in os.walk(static_folder):
+    # never build the build output
+    dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+
+    for name in sorted(files):
+      extension = os.path.splitext(name)[1]
+      if extension not in ASSET_EXTENSIONS:
+        continue
+
+      source = os.path.join(root, name)
+      path = os.path.relpath(source, static_folder).replace(os.sep, '/')
+      with open(source, encoding='utf-8') as f:
+        content = MINIFIERS[extension](f.read()).encode('utf-8')
+
+      target = hashed_name(path, content)
+      write(os.path.join(dist, target), content)
+      # mtime=0 keeps the .gz byte-for-byte the same between builds of the same file
+      write(os.path.join(dist, target + '.gz'), gzip.compress(content, compresslevel=9, mtime=0))
+      if brotli is not None:
+        write(os.path.join(dist, target + '.br'), brotli.compress(content, quality=11))
+
+      manifest[path] = target
+
+  with open(os.path.join(dist, MANIFEST), 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+
+  return manifest
+
+# read the manifest the last build wrote, or an empty one if there hasn't been a build
+def load_manifest(static_folder):
+  try:
+    with open(os.path.join(static_folder, DIST_DIR, MANIFEST)) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return {}
+
+# serve assets from app/static/dist, picking the smallest copy the browser accepts
+# the copies were compressed at build time, so requests never pay for compression
+def init_assets(app):
+  manifest = load_manifest(app.static_folder)
+  dist = os.path.join(app.static_folder, DIST_DIR)
+
+  # the template helper: the hashed URL if the asset was built, otherwise the plain one
+  # (i.e. in development before the first flask build-assets)
+  def asset_url(path):
+    if path in manifest:
+      return '/{}/{}'.format(DIST_DIR, manifest[path])
+    return '/' + path
+
+  def serve_asset(filename):
+    path = safe_join(dist, filename)
+    # only serve files the build wrote, never the .gz/.br copies or the manifest directly
+    if path is None or filename.endswith(('.gz', '.br')) or filename == MANIFEST or not os.path.isfile(path):
+      abort(404)
+
+    encoding = None
+    for name, suffix in ENCODINGS:
+      # quality() is 0 for an encoding the browser didn't list or turned off with ;q=0
+      if request.accept_encodings.quality(name) > 0 and os.path.isfile(path + suffix):
+        encoding, path = name, path + suffix
+        break
+
+    response = send_file(path, mimetype=guess_type(filename)[0], conditional=True, max_age=None)
+    if encoding:
+      response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+  app.add_url_rule('/{}/<path:filename>'.format(DIST_DIR), 'dist', serve_asset)
+  app.jinja_env.globals['asset_url'] = asset_url
@@ -0,0 +1,213 @@
+# in-process caches for rendered HTML
+# each worker process keeps its own copy, so everything stored here must be safe to throw away at any time
+
+# OrderedDict remembers insertion order, which we use to find the least recently used entry
+from collections import OrderedDict
+# a Lock stops two request threads from changing the cache at the same time
+# an Event lets request threads wait for another thread to finish building an entry
+from threading import Lock, Event
+# monotonic() is a clock that never jumps backwards, which is what we want for expiry times
+from time import monotonic
+
+# a dictionary with a maximum size that throws away the least recently used entry when it is full
+# every entry can carry a version (i.e. the updated_at of the row it was built from),
+# and a lookup with a different version counts as a miss
+# it also counts hits and misses so we can tell whether maxsize is big enough
+class LRUCache:
+  def __init__(self, maxsize=1024):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._data = OrderedDict()
+    self._lock = Lock()
+
+  # return the cached value, or None if the key isn't cached or was cached for a different version
+  def get(self, key, version=None):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None or entry[0] != version:
+        self.misses += 1
+        return None
+
+      # mark the entry as the most recently used one
+      self._data.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+
+  def set(self, key, value, version=None):
+    with self._lock:
+      self._data[key] = (version, value)
+      self._data.move_to_end(key)
+
+      # drop the oldest entries until we fit in maxsize again
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+        self.evictions += 1
+
+  # remove a single entry, i.e. when the post it was rendered from changes
+  def pop(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  # numbers for the /api/stats route
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        'size': len(self._data),
+        'maxsize': self.maxsize,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'hit_rate': self.hits / lookups if lookups else 0.0
+      }
+
+# a cache whose entries expire after ttl seconds, for whole pages that are expensive to build
+# only one thread rebuilds an expired entry (request coalescing):
+## while it does, other threads get the expired copy if there is one,
+## or wait for the new copy if there isn't
+class TTLCache:
+  def __init__(self, ttl=5, maxsize=256, wait_timeout=5):
+    self.ttl = ttl
+    self.maxsize = maxsize
+    # how long a waiting thread gives the builder before building the entry itself
+    self.wait_timeout = wait_timeout
+    self.hits = 0
+    self.stale_hits = 0
+    self.misses = 0
+    # key -> (expires_at, value)
+    self._data = OrderedDict()
+    # key -> Event that is set when the thread building that key is done
+    self._building = {}
+    # clear() bumps the generation, so a build that started before an invalidation isn't stored
+    self._generation = 0
+    self._lock = Lock()
+
+  # return the cached value for key, calling build() to make it when it is missing or expired
+  def get_or_build(self, key, build):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is not None and entry[0] > monotonic():
+        self.hits += 1
+        return entry[1]
+
+      event = self._building.get(key)
+      builder = event is None
+      if builder:
+        # nobody is building this key yet, so this thread will
+        event = Event()
+        self._building[key] = event
+      elif entry is not None:
+        # someone else is already rebuilding, so serve the expired copy instead of waiting
+        self.stale_hits += 1
+        return entry[1]
+
+    if not builder:
+      # nothing to serve yet, so wait for the builder to finish and use its copy
+      event.wait(self.wait_timeout)
+      with self._lock:
+        entry = self._data.get(key)
+        if entry is not None:
+          self.hits += 1
+          return entry[1]
+
+      # the builder failed or took too long, so build a copy for this request without storing it
+      with self._lock:
+        self.misses += 1
+      return build()
+
+    try:
+      with self._lock:
+        self.misses += 1
+        generation = self._generation
+
+      value = build()
+      self.set(key, value, generation)
+      return value
+    finally:
+      # always wake up the waiting threads, even if build() raised an error
+      with self._lock:
+        self._building.pop(key, None)
+      event.set()
+
+  # the async read routes can't block on an Event while another request builds a page,
+  # so they look up and store entries themselves without coalescing
+  ## get() returns the value for key, or None if it is missing or expired
+  ## generation() is read before building, and set() skips storing if the cache was cleared since then
+  def get(self, key):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is not None and entry[0] > monotonic():
+        self.hits += 1
+        return entry[1]
+
+      self.misses += 1
+      return None
+
+  def generation(self):
+    with self._lock:
+      return self._generation
+
+  def set(self, key, value, generation):
+    with self._lock:
+      if generation == self._generation:
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+          self._data.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+      self._generation += 1
+
+  # numbers for the /api/stats route
+  def stats(self):
+    with self._lock:
+      return {
+        'size': len(self._data),
+        'maxsize': self.maxsize,
+        'ttl': self.ttl,
+        'hits': self.hits,
+        'stale_hits': self.stale_hits,
+        'misses': self.misses
+      }
+
+# rendered partials/post-info.html for each post, keyed by post id and versioned by the post's updated_at
+# and the counts the card shows, so a card rendered before the post last changed is never served
+## updated_at alone isn't enough: only the worker that handled a write evicts the card, and MySQL's DATETIME
+## keeps whole seconds, so two votes in the same second would leave the other workers showing the first count
+post_cards = LRUCache()
+
+# the version a post's cached card has to match
+def post_card_version(post):
+  return (post.updated_at, post.vote_count, post.comment_count)
+
+# return the rendered post card for a post, rendering it only if the cached copy is missing or out of date
+## render is a function that takes the post and returns its HTML
+def get_post_card(post, render):
+  version = post_card_version(post)
+  html = post_cards.get(post.id, version=version)
+  if html is None:
+    html = render(post)
+    post_cards.set(post.id, html, version=version)
+
+  return html
+
+# rendered homepages for logged-out visitors, keyed by the path including the page cursor
+feed_pages = TTLCache()
+
+# the api write routes call this after they add or remove a post
+def invalidate_feed():
+  feed_pages.clear()
+
+# the api write routes call this after they change a post, its votes or its comments
+def invalidate_post(post_id):
+  post_cards.pop(int(post_id))
+  # the post could be on any cached page of the feed
+  invalidate_feed()
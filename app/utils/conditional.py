@@ -0,0 +1,90 @@
+# HTTP conditional requests for the server-rendered pages
+# the routes work out an ETag (and, for a single post, a Last-Modified time) from a few cheap columns first,
+# so a browser (or proxy) whose copy is still current gets a 304 before anything is loaded or rendered
+
+import hashlib
+import json
+import os
+from datetime import timezone
+
+from flask import request, make_response, Response
+
+from app.utils.serializers import make_etag
+from app.utils.assets import load_manifest
+
+# the ETag and Last-Modified for a page of posts (or a single post)
+## rows only need id, updated_at, vote_count and comment_count, so cheap column queries work as well as Post objects
+## parts are anything else the page depends on, i.e. the APP_VERSION from the app config (see app_version()),
+## the cursors and whether the visitor is logged in
+## dated=True also returns a Last-Modified time; only a single post's page should ask for one, because on a list
+## the newest updated_at doesn't change when a post is deleted or pushed off the page by a newer one,
+## so a client sending only If-Modified-Since would keep getting 304s for a stale list
+## (the ETag covers which posts are on the page, so lists are still revalidated with it)
+def validators(rows, *parts, dated=False):
+  etag = make_etag([(row.id, row.updated_at, row.vote_count, row.comment_count) for row in rows], *parts)
+  last_modified = None
+  if dated:
+    # updated_at is stored in the server's local time without a timezone, HTTP dates are in UTC
+    last_modified = max((row.updated_at for row in rows), default=None)
+    if last_modified is not None:
+      last_modified = last_modified.astimezone(timezone.utc)
+
+  return etag, last_modified
+
+# a token for what the running code renders pages with: the templates and the asset manifest
+# it goes into every ETag, so a deploy that changes a template or rebuilds the assets also changes the ETags,
+# and a browser revalidating a page gets the new HTML (with the new /dist/ URLs) instead of a 304
+# for a page whose posts haven't changed
+## create_app() works it out once, when the APP_VERSION config value isn't set
+def app_version(app):
+  digest = hashlib.sha1(json.dumps(load_manifest(app.static_folder), sort_keys=True).encode('utf-8'))
+
+  templates = os.path.join(app.root_path, app.template_folder)
+  for root, dirs, files in sorted(os.walk(templates)):
+    dirs.sort()
+    for name in sorted(files):
+      path = os.path.join(root, name)
+      digest.update(os.path.relpath(path, templates).encode('utf-8'))
+      with open(path, 'rb') as f:
+        digest.update(f.read())
+
+  return digest.hexdigest()[:12]
+
+# True if the copy the client already has is still current
+## request defaults to Flask's; the async read routes pass in Quart's, which has the same headers
+def is_fresh(etag, last_modified, request=request):
+  # If-None-Match wins when the client sends both
+  if request.if_none_match:
+    return request.if_none_match.contains(etag)
+
+  if request.if_modified_since and last_modified is not None:
+    # HTTP dates only have whole seconds
+    return last_modified.replace(microsecond=0) <= request.if_modified_since
+
+  return False
+
+# add the validators and caching rules to a response
+## public pages (no session-dependent content) may be stored by shared proxies for shared_max_age seconds;
+## everything else is only for the visitor's own browser, and must be revalidated every time
+def set_validators(response, etag, last_modified, public, shared_max_age=0):
+  response.set_etag(etag)
+  if last_modified is not None:
+    response.last_modified = last_modified
+
+  if public:
+    response.headers['Cache-Control'] = 'public, max-age=0, s-maxage={}'.format(shared_max_age)
+  else:
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+  # a logged-in visitor's page depends on their session cookie, so caches must never mix the two up
+  response.vary.add('Cookie')
+  return response
+
+# answer with 304 if the client's copy is current, otherwise with the page built by render()
+def conditional(etag, last_modified, public, render, shared_max_age=0):
+  if is_fresh(etag, last_modified):
+    response = Response(status=304)
+  else:
+    response = make_response(render())
+
+  return set_validators(response, etag, last_modified, public, shared_max_age)
@@ -0,0 +1,68 @@
+# keep the stored vote_count and comment_count columns on posts in step with the votes and comments tables
+
+# event lets us run code whenever SQLAlchemy inserts or deletes a row
+# select and func build the COUNT() subqueries used to reconcile the counters
+from sqlalchemy import event, select, func
+
+from app.models import Post, Comment, Vote
+
+# add amount to one of the counter columns of a post
+## connection is the connection the current flush is using,
+## so the counter UPDATE commits (or rolls back) together with the vote/comment it counts
+def bump(connection, post_id, column, amount):
+  connection.execute(
+    Post.__table__.update()
+    .where(Post.id == post_id)
+    .values({column: column + amount})
+  )
+
+# the listeners below fire during db.commit() for every Vote/Comment the ORM inserts or deletes,
+# so api.upvote, api.comment and seeds.py never have to remember to update the counters themselves
+@event.listens_for(Vote, 'after_insert')
+def vote_inserted(mapper, connection, target):
+  bump(connection, target.post_id, Post.vote_count, 1)
+
+@event.listens_for(Vote, 'after_delete')
+def vote_deleted(mapper, connection, target):
+  bump(connection, target.post_id, Post.vote_count, -1)
+
+@event.listens_for(Comment, 'after_insert')
+def comment_inserted(mapper, connection, target):
+  bump(connection, target.post_id, Post.comment_count, 1)
+
+@event.listens_for(Comment, 'after_delete')
+def comment_deleted(mapper, connection, target):
+  bump(connection, target.post_id, Post.comment_count, -1)
+
+# recompute vote_count from the votes table for just the given posts
+def recount_votes(connection, post_ids):
+  votes = (
+    select([func.count(Vote.id)])
+    .where(Vote.post_id == Post.id)
+    .scalar_subquery()
+  )
+
+  connection.execute(
+    Post.__table__.update()
+    .where(Post.id.in_(list(post_ids)))
+    .values(vote_count=votes)
+  )
+
+# recompute every counter from the votes and comments tables
+# use this once after adding the columns to an existing database,
+# or whenever rows were changed behind the ORM's back (i.e. by hand in MySQL)
+def reconcile(connection):
+  votes = (
+    select([func.count(Vote.id)])
+    .where(Vote.post_id == Post.id)
+    .scalar_subquery()
+  )
+  comments = (
+    select([func.count(Comment.id)])
+    .where(Comment.post_id == Post.id)
+    .scalar_subquery()
+  )
+
+  return connection.execute(
+    Post.__table__.update().values(vote_count=votes, comment_count=comments)
+  ).rowcount
@@ -0,0 +1,74 @@
+# the domain a post links to, i.e. https://www.Example.com:8080/a?b=c -> example.com
+# it is worked out once, when the post is written, and stored in posts.domain,
+# so rendering a post card doesn't parse its URL, and /from/<domain> finds a domain's posts through an index
+## api.create stores it for new posts, api.update fills it in for a post that doesn't have it yet,
+## and the backfill-domains command fills it in for every older post
+
+from urllib.parse import urlsplit
+
+from sqlalchemy import select, bindparam
+
+from app.models import Post
+
+# as long as the posts.domain column
+MAX_DOMAIN_LENGTH = 100
+# how many posts the backfill updates per transaction
+BACKFILL_CHUNK = 1000
+
+# the normalized domain of a URL: lowercase, without the port, the login or a leading www.
+# returns None if the URL has no host at all
+def url_domain(url):
+  text = (url or '').strip()
+  # urlsplit() only finds the host after a //, so a URL typed without a scheme (example.com/page) needs one
+  if '//' not in text:
+    text = '//' + text
+
+  try:
+    host = urlsplit(text).hostname or ''
+  except ValueError:
+    # i.e. an unclosed [ in an IPv6 address
+    host = ''
+
+  host = host.rstrip('.')
+  if host.startswith('www.'):
+    host = host[len('www.'):]
+
+  return host[:MAX_DOMAIN_LENGTH] or None
+
+# fill in posts.domain for every post that doesn't have it yet
+## engine is the engine from app.db; each chunk of posts is updated in its own short transaction
+# returns the number of posts updated
+def backfill(engine):
+  # one UPDATE sent with every row of the chunk at once (executemany)
+  ## keep updated_at as it is: the card shows the same domain as before, so cached cards and ETags stay valid
+  update = (
+    Post.__table__.update()
+    .where(Post.id == bindparam('post_id'))
+    .values(domain=bindparam('post_domain'), updated_at=Post.updated_at)
+  )
+
+  updated = 0
+  last_id = 0
+  while True:
+    with engine.begin() as connection:
+      rows = connection.execute(
+        select([Post.id, Post.post_url])
+        .where(Post.id > last_id)
+        .where(Post.domain.is_(None))
+        .order_by(Post.id)
+        .limit(BACKFILL_CHUNK)
+      ).all()
+      if not rows:
+        return updated
+
+      values = [
+        {'post_id': row.id, 'post_domain': url_domain(row.post_url)}
+        for row in rows
+      ]
+      # a URL without a host stays NULL, it has no domain to list it under
+      values = [value for value in values if value['post_domain'] is not None]
+      if values:
+        connection.execute(update, values)
+
+    updated += len(values)
+    last_id = rows[-1].id
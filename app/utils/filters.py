@@ -1,10 +1,22 @@
 # Filters allow us to format data for use in the Jinja templates
 # Jinja template engine is part of Flask
 
+# the filters are pure functions, so lru_cache() remembers what they returned for the values they were called with
+# and every later call with the same values skips the work
+from functools import lru_cache
+
+# the URL parsing that also fills in posts.domain
+from app.utils.domains import url_domain
+
 # this filter receives a datetime object
 def format_date(date):
+  # only the day is shown, so every post from the same day shares one cached string
+  return format_day(date.date())
+
+@lru_cache(maxsize=1024)
+def format_day(day):
   # and use the strftime method to cover the object to a string
-  return date.strftime('%m/%d/%y')
+  return day.strftime('%m/%d/%y')
 
 # this is to test the format_date function
 # run the following command to test it:
@@ -13,8 +25,10 @@ def format_date(date):
 # print(format_date(datetime.now()))
 
 # this filter removes all extraneous information from the URL string
+# new posts store this in post.domain, so templates only need it for posts written before that column was added
+@lru_cache(maxsize=4096)
 def format_url(url):
-  return url.replace('http://', '').replace('https://', '').replace('www.', '').split('/')[0].split('?')[0]
+  return url_domain(url) or url
 
 # this is to test the format_url function
 # run the following command to test it:
@@ -23,6 +37,7 @@ def format_url(url):
 # print(format_url('https://www.google.com?q=test'))
 
 # this filter pluralizes words as applicable
+@lru_cache(maxsize=1024)
 def format_plural(amount, word):
   if amount != 1:
     return word + 's'
@@ -33,4 +48,4 @@ def format_plural(amount, word):
 # run the following command to test it:
 # python app/utils/filters.py
 # print(format_plural(2, 'cat'))
-# print(format_plural(1, 'dog'))
\ No newline at end of file
+# print(format_plural(1, 'dog'))
@@ -0,0 +1,61 @@
+# run bcrypt hashing and checking on a small pool of worker threads
+# bcrypt is slow on purpose, so a burst of logins or signups could otherwise tie up every request thread;
+# the pool caps how many hashes run at once and turns requests away once its queue is full
+
+# getenv() reads the settings from the environment, just like DB_URL in app/db
+from os import getenv
+# the worker pool; bcrypt releases the GIL while it hashes, so threads really do run in parallel
+from concurrent.futures import ThreadPoolExecutor
+# a BoundedSemaphore counts the running and queued jobs so we can refuse new ones when the pool is full
+from threading import BoundedSemaphore
+
+import bcrypt
+
+# the bcrypt work factor; every +1 doubles the time one hash takes
+BCRYPT_ROUNDS = int(getenv('BCRYPT_ROUNDS', 12))
+# how many hashes can run at the same time
+HASH_WORKERS = int(getenv('HASH_WORKERS', 2))
+# how many more hashes can wait for a free worker before we start refusing them
+HASH_QUEUE = int(getenv('HASH_QUEUE', 8))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+_slots = BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+# raised when the pool and its queue are full
+# the api routes turn this into a 503 so the client can try again later
+class HashingBusy(Exception):
+  pass
+
+# run func on the pool and wait for its result
+def _run(func, *args):
+  # don't wait for a slot, refuse straight away so the request thread is freed
+  if not _slots.acquire(blocking=False):
+    raise HashingBusy()
+
+  try:
+    return _executor.submit(func, *args).result()
+  finally:
+    _slots.release()
+
+def _hash(password):
+  # gensalt() makes a new random salt for every password, so two users with the same password get different hashes
+  return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+def _check(password, hashed):
+  return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+# return the bcrypt hash of a password as a string
+def hash_password(password):
+  return _run(_hash, password)
+
+# return True if password matches the stored hash
+def check_password(password, hashed):
+  return _run(_check, password, hashed)
+
+# return True if a stored hash was made with a different work factor than BCRYPT_ROUNDS
+# a bcrypt hash looks like $2b$12$..., where 12 is the work factor it was made with
+def needs_rehash(hashed):
+  try:
+    return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+  except (IndexError, ValueError):
+    return True
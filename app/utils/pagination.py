@@ -0,0 +1,202 @@
+# create a pagination module so the feed routes never load every post at once
+
+# datetime lets us turn the cursor string back into a timestamp
+from datetime import datetime
+# math.isfinite() spots a nan or inf score in a cursor
+import math
+# or_ and and_ let us build the "comes after this row" WHERE clause
+from sqlalchemy import or_, and_
+
+# how many posts a page shows when the app config doesn't say otherwise
+DEFAULT_PAGE_SIZE = 30
+# the largest page size we will ever allow, no matter what is configured
+MAX_PAGE_SIZE = 100
+
+# read a hot score back from a cursor
+## nan and inf never come out of ranking.hot_score() and the database driver can't send them, so refuse them
+def parse_score(text):
+  value = float(text)
+  if not math.isfinite(value):
+    raise ValueError('not a finite score: {}'.format(text))
+  return value
+
+# the cursor stores the timestamp with microseconds so two posts created in the same second still sort apart
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+# the columns a feed can be sorted by, and how to write their values into a cursor and read them back
+SORT_KEYS = {
+  'created_at': (
+    lambda value: value.strftime(CURSOR_DATE_FORMAT),
+    lambda text: datetime.strptime(text, CURSOR_DATE_FORMAT)
+  ),
+  'hot_score': (
+    lambda value: repr(float(value)),
+    parse_score
+  ),
+  # search results are ranked by a whole-number score (see app/utils/search.py)
+  'score': (
+    lambda value: str(int(value)),
+    int
+  )
+}
+
+# the ways a feed can be sorted (i.e. ?sort=hot), and the Post column each one pages through
+## new is newest first, hot is by the stored ranking score (see app/utils/ranking.py)
+SORTS = {
+  'new': 'created_at',
+  'hot': 'hot_score'
+}
+
+# read the ?sort= query parameter, falling back to the newest posts
+def parse_sort(text):
+  return text if text in SORTS else 'new'
+
+# a Page holds the rows for one page plus the cursors used by the next/previous links
+# a cursor of None means there is no page in that direction
+class Page:
+  def __init__(self, items, next_cursor=None, prev_cursor=None):
+    self.items = items
+    self.next_cursor = next_cursor
+    self.prev_cursor = prev_cursor
+
+# turn a row's sort value and id into a cursor string, i.e. '20210301120000000000-42'
+def encode_cursor(value, id, sort_by='created_at'):
+  return '{}-{}'.format(SORT_KEYS[sort_by][0](value), id)
+
+# turn a cursor string back into a (value, id) tuple
+# a missing or malformed cursor returns None so the route just shows the first page
+def decode_cursor(cursor, sort_by='created_at'):
+  if not cursor:
+    return None
+
+  try:
+    # split on the last dash, since a score like 1e-05 has dashes of its own
+    value, id = cursor.rsplit('-', 1)
+    return SORT_KEYS[sort_by][1](value), int(id)
+  except ValueError:
+    return None
+
+# keep the requested page size between 1 and MAX_PAGE_SIZE
+def clamp_page_size(page_size):
+  return max(1, min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+# keyset pagination over a query that is ordered highest first by (sort_by, id)
+# instead of OFFSET, every page starts right after the row in the cursor,
+# so the database can seek straight to it in the index and deep pages are as fast as page one
+## query is an unordered query on the model, i.e. db.query(Post).filter(...)
+## model is the mapped class with the sort_by and id columns
+## before is the cursor of the last row on the current page (used by the "next" link)
+## after is the cursor of the first row on the current page (used by the "previous" link)
+## sort_by is one of SORT_KEYS: created_at for newest first, hot_score for the hot feed
+def paginate(query, model, before=None, after=None, page_size=DEFAULT_PAGE_SIZE, sort_by='created_at'):
+  page_size = clamp_page_size(page_size)
+  rows = keyset_query(query, model, before, after, page_size, sort_by).all()
+  return make_page(rows, before, after, page_size, sort_by)
+
+# the same as paginate() for the async read routes (see app/routes/aio.py)
+## db is an AsyncSession and statement is an unordered select(), i.e. select(Post).where(...)
+## scalars=False returns plain rows, for a select() of single columns instead of a model
+async def paginate_async(db, statement, model, before=None, after=None, page_size=DEFAULT_PAGE_SIZE, sort_by='created_at', scalars=True):
+  page_size = clamp_page_size(page_size)
+  result = await db.execute(keyset_query(statement, model, before, after, page_size, sort_by))
+  rows = result.scalars().all() if scalars else result.all()
+  return make_page(rows, before, after, page_size, sort_by)
+
+# add the WHERE, ORDER BY and LIMIT for one page to a query
+# this works the same on a Query and on a select() statement
+def keyset_query(query, model, before, after, page_size, sort_by):
+  before = decode_cursor(before, sort_by)
+  after = decode_cursor(after, sort_by)
+  column = getattr(model, sort_by)
+
+  if after is not None:
+    # walk back towards the top of the feed, so read in ascending order and flip the rows afterwards (see make_page())
+    value, id = after
+    return (
+      query
+      .filter(or_(
+        column > value,
+        and_(column == value, model.id > id)
+      ))
+      .order_by(column.asc(), model.id.asc())
+      # fetch one extra row to find out whether there is another page in this direction
+      .limit(page_size + 1)
+    )
+
+  if before is not None:
+    value, id = before
+    query = query.filter(or_(
+      column < value,
+      and_(column == value, model.id < id)
+    ))
+
+  return (
+    query
+    .order_by(column.desc(), model.id.desc())
+    .limit(page_size + 1)
+  )
+
+# turn the rows keyset_query() returned into a Page with its next/previous cursors
+def make_page(rows, before, after, page_size, sort_by):
+  def cursor(row):
+    return encode_cursor(getattr(row, sort_by), row.id, sort_by)
+
+  has_more = len(rows) > page_size
+
+  if decode_cursor(after, sort_by) is not None:
+    items = list(reversed(rows[:page_size]))
+
+    return Page(
+      items,
+      # we came from a page further down, so there is always a next page to go back to
+      next_cursor=cursor(items[-1]) if items else None,
+      prev_cursor=cursor(items[0]) if has_more else None
+    )
+
+  items = rows[:page_size]
+
+  return Page(
+    items,
+    next_cursor=cursor(items[-1]) if has_more else None,
+    # only pages reached through a cursor have something higher up to go back to
+    prev_cursor=cursor(items[0]) if decode_cursor(before, sort_by) is not None and items else None
+  )
+
+# keyset pagination that reads oldest first, for lists that only ever grow at the end (i.e. a post's comments)
+# there is no previous page: the client keeps the rows it has and asks for the ones after the last of them
+## cursor is the cursor of the last row the client already has, or None for the first page
+def paginate_oldest_first(query, model, cursor=None, page_size=DEFAULT_PAGE_SIZE, sort_by='created_at'):
+  page_size = clamp_page_size(page_size)
+  rows = oldest_first_query(query, model, cursor, page_size, sort_by).all()
+  return make_oldest_first_page(rows, page_size, sort_by)
+
+# the same as paginate_oldest_first() for the async read routes
+async def paginate_oldest_first_async(db, statement, model, cursor=None, page_size=DEFAULT_PAGE_SIZE, sort_by='created_at'):
+  page_size = clamp_page_size(page_size)
+  result = await db.execute(oldest_first_query(statement, model, cursor, page_size, sort_by))
+  return make_oldest_first_page(result.scalars().all(), page_size, sort_by)
+
+def oldest_first_query(query, model, cursor, page_size, sort_by):
+  cursor = decode_cursor(cursor, sort_by)
+  column = getattr(model, sort_by)
+
+  if cursor is not None:
+    value, id = cursor
+    query = query.filter(or_(
+      column > value,
+      and_(column == value, model.id > id)
+    ))
+
+  return (
+    query
+    .order_by(column.asc(), model.id.asc())
+    .limit(page_size + 1)
+  )
+
+def make_oldest_first_page(rows, page_size, sort_by):
+  items = rows[:page_size]
+  next_cursor = None
+  if len(rows) > page_size:
+    next_cursor = encode_cursor(getattr(items[-1], sort_by), items[-1].id, sort_by)
+
+  return Page(items, next_cursor=next_cursor)
@@ -0,0 +1,121 @@
+# opt-in per-request profiling
+# when PROFILING is turned on, every response gets a Server-Timing header that shows (i.e. in the browser's dev tools)
+# how long the request spent in SQL and in Jinja, how many statements it ran and how many ORM objects it loaded
+# requests slower than SLOW_REQUEST_MS are also written to the log as one JSON line
+
+import json
+from time import perf_counter
+
+# g holds the numbers for the current request, request tells us which route they belong to
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+# listening on the Engine class catches the statements of every engine, including the read replicas
+# and ones created after the app (app.db creates its engine the first time it is needed)
+from sqlalchemy.engine import Engine
+# listening on the Mapper class itself catches the load event for every model
+from sqlalchemy.orm import Mapper
+
+# engine event: remember when a statement started on this connection
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('profiling_start', []).append(perf_counter())
+
+# engine event: add the finished statement to the current request's numbers
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  elapsed = perf_counter() - conn.info['profiling_start'].pop()
+
+  # statements run outside a request (i.e. the vote buffer thread) aren't profiled
+  if not has_request_context() or 'profile' not in g:
+    return
+
+  profile = g.profile
+  profile['sql_count'] += 1
+  profile['sql_time'] += elapsed
+  if elapsed > profile['slowest_time']:
+    profile['slowest_time'] = elapsed
+    profile['slowest_statement'] = ' '.join(statement.split())
+
+# engine event: a statement failed, so after_cursor_execute won't run for it
+def handle_error(context):
+  if context.connection is not None and context.connection.info.get('profiling_start'):
+    context.connection.info['profiling_start'].pop()
+
+# mapper event: count every object the ORM builds from a row
+def object_loaded(target, context):
+  if has_request_context() and 'profile' in g:
+    g.profile['orm_objects'] += 1
+
+# template signals: time render_template() calls
+## templates can be rendered inside other templates, so keep a stack of start times
+def template_started(sender, template, context, **extra):
+  if 'profile' in g:
+    g.profile['render_starts'].append(perf_counter())
+
+def template_finished(sender, template, context, **extra):
+  if 'profile' in g and g.profile['render_starts']:
+    elapsed = perf_counter() - g.profile['render_starts'].pop()
+    # only count the outermost template, its time already includes the ones inside it
+    if not g.profile['render_starts']:
+      g.profile['render_time'] += elapsed
+
+def start_profile():
+  g.profile = {
+    'start': perf_counter(),
+    'sql_count': 0,
+    'sql_time': 0.0,
+    'slowest_time': 0.0,
+    'slowest_statement': None,
+    'orm_objects': 0,
+    'render_time': 0.0,
+    'render_starts': []
+  }
+
+# build the Server-Timing header and, for slow requests, the log line
+def finish_profile(app, response):
+  profile = g.pop('profile', None)
+  if profile is None:
+    return response
+
+  total = perf_counter() - profile['start']
+
+  # durations in Server-Timing are in milliseconds
+  response.headers['Server-Timing'] = ', '.join([
+    'sql;dur={:.2f};desc="{} statements"'.format(profile['sql_time'] * 1000, profile['sql_count']),
+    'sql-slowest;dur={:.2f}'.format(profile['slowest_time'] * 1000),
+    'orm;desc="{} objects"'.format(profile['orm_objects']),
+    'render;dur={:.2f}'.format(profile['render_time'] * 1000),
+    'total;dur={:.2f}'.format(total * 1000)
+  ])
+
+  threshold = app.config['SLOW_REQUEST_MS']
+  if threshold is not None and total * 1000 >= threshold:
+    app.logger.warning(json.dumps({
+      'event': 'slow_request',
+      'method': request.method,
+      'path': request.full_path,
+      'endpoint': request.endpoint,
+      'status': response.status_code,
+      'total_ms': round(total * 1000, 2),
+      'sql_ms': round(profile['sql_time'] * 1000, 2),
+      'sql_count': profile['sql_count'],
+      'slowest_sql_ms': round(profile['slowest_time'] * 1000, 2),
+      'slowest_sql': profile['slowest_statement'],
+      'orm_objects': profile['orm_objects'],
+      'render_ms': round(profile['render_time'] * 1000, 2)
+    }))
+
+  return response
+
+# hook everything up when PROFILING is turned on in the app config
+def init_profiling(app):
+  if not app.config['PROFILING']:
+    return
+
+  event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+  event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+  event.listen(Engine, 'handle_error', handle_error)
+  event.listen(Mapper, 'load', object_loaded)
+  before_render_template.connect(template_started, app)
+  template_rendered.connect(template_finished, app)
+
+  app.before_request(start_profile)
+  app.after_request(lambda response: finish_profile(app, response))
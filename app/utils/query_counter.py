@@ -0,0 +1,35 @@
+# count the SQL statements that are sent to the database
+# this lets us catch N+1 query problems, where rendering a list of rows quietly runs one extra query per row
+
+# contextmanager turns a generator function into something we can use in a with block
+from contextlib import contextmanager
+# event lets us listen to every statement the engine executes
+from sqlalchemy import event
+
+# holds the statements seen inside a count_queries() block
+class QueryCount:
+  def __init__(self):
+    self.statements = []
+
+  @property
+  def count(self):
+    return len(self.statements)
+
+# use it like this:
+#   with count_queries(engine) as queries:
+#     client.get('/')
+#   print(queries.count)
+@contextmanager
+def count_queries(engine):
+  queries = QueryCount()
+
+  # before_cursor_execute fires once for every statement sent to the database
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries.statements.append(statement)
+
+  event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+  try:
+    yield queries
+  finally:
+    # always stop listening, even if the block raised an error
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
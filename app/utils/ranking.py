@@ -0,0 +1,67 @@
+# the "hot" ranking for the homepage, in the style of Hacker News:
+# a post's score grows with its votes and comments and shrinks as it gets older
+# the score is stored in posts.hot_score, so serving the hot feed is a top-N read on an index instead of
+# scoring every post on every request
+## api.upvote and api.comment refresh the score of the post they change
+## the redecay-scores command (run it from cron every few minutes) lowers the scores of recent posts as they age
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.models import Post
+
+# how fast scores fall with age; Hacker News uses 1.8
+GRAVITY = 1.8
+# a comment counts as this many votes
+COMMENT_WEIGHT = 0.5
+# posts older than this many days get no more re-decay passes; by then their score is close to zero anyway
+REDECAY_DAYS = 7
+# how many posts each re-decay pass updates per transaction
+REDECAY_CHUNK = 1000
+
+# the score for a post with these counts, created at created_at, as of now
+def hot_score(vote_count, comment_count, created_at, now=None):
+  now = now or datetime.now()
+  age_hours = max(0.0, (now - created_at).total_seconds() / 3600)
+  # the +1 lets a brand new post with no votes yet show up on the hot feed for a while
+  points = 1 + vote_count + comment_count * COMMENT_WEIGHT
+  return points / (age_hours + 2) ** GRAVITY
+
+# recompute and store the score of the given posts
+## connection is the connection of the caller's transaction, so the score commits with the vote/comment that changed it
+def refresh_scores(connection, post_ids, now=None):
+  now = now or datetime.now()
+  rows = connection.execute(
+    select([Post.id, Post.vote_count, Post.comment_count, Post.created_at])
+    .where(Post.id.in_(list(post_ids)))
+  ).fetchall()
+
+  for id, vote_count, comment_count, created_at in rows:
+    connection.execute(
+      Post.__table__.update()
+      .where(Post.id == id)
+      # keep updated_at as it is: the score isn't shown anywhere, so cached cards and ETags stay valid
+      .values(hot_score=hot_score(vote_count, comment_count, created_at, now), updated_at=Post.updated_at)
+    )
+
+  return len(rows)
+
+# lower the scores of every post younger than `days` days (plus one more day, so the posts that just left the window
+# get a final low score) as of now
+## engine is the engine from app.db; each chunk of posts is updated in its own short transaction
+## pass days=None to rescore every post, i.e. after adding the column
+def redecay(engine, days=REDECAY_DAYS):
+  now = datetime.now()
+  query = select([Post.id]).order_by(Post.id)
+  if days is not None:
+    query = query.where(Post.created_at >= now - timedelta(days=days + 1))
+
+  with engine.connect() as connection:
+    ids = [row[0] for row in connection.execute(query)]
+
+  for i in range(0, len(ids), REDECAY_CHUNK):
+    with engine.begin() as connection:
+      refresh_scores(connection, ids[i:i + REDECAY_CHUNK], now)
+
+  return len(ids)
@@ -0,0 +1,185 @@
+# per-client rate limits for the write routes, and a cap on how many requests one worker serves at once
+# without them one script can send signups, logins, comments and upvotes as fast as it likes,
+# using up the connection pool and the bcrypt workers, and then the read pages fail too
+#
+# rate limits are token buckets: every client gets a bucket of `burst` tokens per route,
+# each request takes one, and the bucket fills back up at `burst` tokens every `period` seconds
+# a client is its session's user_id when logged in, otherwise its IP address
+# (behind a proxy, wrap the app in werkzeug's ProxyFix so request.remote_addr is the client's address)
+#
+# the buckets live in a store:
+## MemoryStore keeps them in this process, so each worker counts on its own
+## SQLiteStore keeps them in a SQLite file, so every worker on the machine shares the same buckets
+#
+# both checks run in before_request, so a refused request never gets as far as a database connection
+
+import logging
+import math
+import sqlite3
+from threading import Lock, BoundedSemaphore, local
+from time import time
+from os import getenv
+
+from flask import g, request, session, jsonify
+
+from app.db.pool import engine_options
+
+logger = logging.getLogger(__name__)
+
+# the endpoints that serve files and never touch the database, so the concurrency cap skips them
+FILE_ENDPOINTS = ('static', 'dist')
+
+# the token bucket: take one token from a bucket that had `tokens` at `updated`
+## rate is tokens added per second, burst is the most the bucket holds
+# returns the tokens left, whether the request may go ahead and how many seconds until it could
+def take_token(tokens, updated, now, rate, burst):
+  # a bucket we haven't seen yet, or haven't seen for a while, is full
+  tokens = burst if tokens is None else min(burst, tokens + (now - updated) * rate)
+
+  if tokens >= 1:
+    return tokens - 1, True, 0.0
+
+  return tokens, False, (1 - tokens) / rate
+
+# keeps the buckets in a dictionary in this process
+class MemoryStore:
+  # drop the buckets that have filled back up once there are this many
+  MAX_BUCKETS = 10000
+
+  def __init__(self):
+    self._lock = Lock()
+    # key -> (tokens, updated, the time the bucket is full again)
+    self._buckets = {}
+
+  # returns (allowed, seconds until the client may try again)
+  def take(self, key, rate, burst, now):
+    with self._lock:
+      tokens, updated, _ = self._buckets.get(key, (None, now, now))
+      tokens, allowed, retry_after = take_token(tokens, updated, now, rate, burst)
+      self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+      # a full bucket is the same as no bucket, so forgetting those keeps memory bounded
+      if len(self._buckets) > self.MAX_BUCKETS:
+        self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+
+    return allowed, retry_after
+
+# keeps the buckets in a SQLite file that every worker on the machine opens,
+# a local stand-in for a shared store like Redis
+class SQLiteStore:
+  # delete the buckets that have filled back up about once every this many requests
+  PRUNE_EVERY = 1000
+
+  def __init__(self, path):
+    self.path = path
+    # sqlite3 connections can't be shared between threads, so each request thread opens its own
+    self._local = local()
+    self._count = 0
+
+  def _connection(self):
+    connection = getattr(self._local, 'connection', None)
+    if connection is None:
+      # isolation_level=None lets us BEGIN IMMEDIATE ourselves
+      ## timeout is how long to wait for another worker's transaction before giving up
+      connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+      connection.execute(
+        'CREATE TABLE IF NOT EXISTS rate_limit_buckets '
+        '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+      )
+      self._local.connection = connection
+    return connection
+
+  def take(self, key, rate, burst, now):
+    try:
+      connection = self._connection()
+      # BEGIN IMMEDIATE takes the write lock before reading, so two workers can't both spend the last token
+      connection.execute('BEGIN IMMEDIATE')
+      try:
+        row = connection.execute('SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?', (key,)).fetchone()
+        tokens, allowed, retry_after = take_token(row[0] if row else None, row[1] if row else now, now, rate, burst)
+        connection.execute(
+          'INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+          (key, tokens, now, now + (burst - tokens) / rate)
+        )
+
+        self._count += 1
+        if self._count % self.PRUNE_EVERY == 0:
+          connection.execute('DELETE FROM rate_limit_buckets WHERE full_at <= ?', (now,))
+
+        connection.execute('COMMIT')
+      except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    except sqlite3.Error:
+      # a broken or busy store shouldn't take the site down with it, so let the request through
+      logger.exception('Rate limit store failed, allowing the request')
+      return True, 0.0
+
+    return allowed, retry_after
+
+# the store for the RATE_LIMIT_STORE config value: None for MemoryStore, a file path for SQLiteStore,
+# or any object with the same take() method
+def make_store(setting):
+  if setting is None:
+    return MemoryStore()
+  if isinstance(setting, str):
+    return SQLiteStore(setting)
+  return setting
+
+# who a request counts against: the logged-in user, or else the address it came from
+def client_key():
+  user_id = session.get('user_id')
+  if user_id is not None:
+    return 'user:{}'.format(user_id)
+  return 'ip:{}'.format(request.remote_addr)
+
+# the answer for a refused request, with how many whole seconds to wait before trying again
+def too_many(status, message, retry_after):
+  return jsonify(message = message), status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+# the most requests a worker serves at once when MAX_CONCURRENT_REQUESTS is None:
+# as many as the connection pool can give a connection to without making anyone wait
+# returns None (no limit) for a pool that isn't sized, i.e. SQLite
+def pool_capacity():
+  options = engine_options(getenv('DB_URL'))
+  if 'pool_size' not in options:
+    return None
+  return options['pool_size'] + options.get('max_overflow', 0)
+
+# hook the checks up to the app
+## RATE_LIMITS maps an endpoint to (burst, period), i.e. {'api.login': (10, 60)} for 10 logins a minute
+## RATE_LIMIT_STORE picks the store (see make_store())
+## MAX_CONCURRENT_REQUESTS caps the requests in flight in this worker; None sizes it from the pool, 0 turns it off
+def init_rate_limits(app):
+  limits = app.config['RATE_LIMITS'] or {}
+  store = make_store(app.config['RATE_LIMIT_STORE'])
+
+  capacity = app.config['MAX_CONCURRENT_REQUESTS']
+  if capacity is None:
+    capacity = pool_capacity()
+  slots = BoundedSemaphore(capacity) if capacity else None
+
+  def check_limits():
+    # per-client rate limit for this endpoint
+    limit = limits.get(request.endpoint)
+    if limit is not None:
+      burst, period = limit
+      key = '{}:{}'.format(request.endpoint, client_key())
+      allowed, retry_after = store.take(key, burst / period, burst, time())
+      if not allowed:
+        return too_many(429, 'Too many requests, try again shortly', retry_after)
+
+    # the worker is already serving as many requests as it has connections for, so turn this one away now
+    # rather than let it wait for a connection and then time out
+    if slots is not None and request.endpoint not in FILE_ENDPOINTS:
+      if not slots.acquire(blocking=False):
+        return too_many(503, 'Server busy, try again shortly', 1)
+      g.request_slot = True
+
+  # give the slot back however the request ended
+  def release_slot(e=None):
+    if g.pop('request_slot', False):
+      slots.release()
+
+  app.before_request(check_limits)
+  app.teardown_request(release_slot)
@@ -0,0 +1,212 @@
+# full-text search over post titles and comments
+# LIKE '%term%' can't use an index, so every search would read every post and comment
+# instead we keep an inverted index in the search_terms table: for every word, the posts it appears in
+# looking a word up is then an index range scan whose cost depends on how many posts use the word,
+# not on how many posts there are
+# api.create, api.update and api.comment keep the index up to date in the same transaction
+# (deleting a post deletes its terms through the foreign key),
+# and flask rebuild-search builds it again from the posts and comments tables
+
+import re
+from collections import Counter
+
+from sqlalchemy import select, func
+
+from app.models import Post, Comment, SearchTerm
+from app.utils.pagination import paginate
+
+# a word in a title counts this many times as much as a word in a comment
+TITLE_WEIGHT = 3
+# words shorter than this are skipped, and longer ones are cut down to fit the term column
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 40
+# the most words a search uses, so a pasted paragraph can't turn into a huge query
+MAX_QUERY_TERMS = 8
+# words so common that indexing them would only make the index bigger and searches slower
+STOP_WORDS = frozenset((
+  'a an and are as at be but by for from has have how i in is it its of on or that the this to was what when '
+  'where which who why will with you your'
+).split())
+# how many posts flask rebuild-search indexes per transaction
+REBUILD_CHUNK = 1000
+
+# letters and digits in any language; everything else separates words
+WORD = re.compile(r'[^\W_]+')
+
+# split text into the words we index, i.e. 'Python 3.12 is out!' -> ['python', '3', '12', 'out']
+def tokenize(text):
+  return [
+    word[:MAX_TERM_LENGTH]
+    for word in WORD.findall((text or '').lower())
+    if len(word) >= MIN_TERM_LENGTH and word not in STOP_WORDS
+  ]
+
+# how much each word of a piece of text adds to a post's weights
+def term_weights(text, weight=1):
+  counts = Counter()
+  for term in tokenize(text):
+    counts[term] += weight
+  return counts
+
+# an INSERT into search_terms that adds to the weight if the (term, post_id) row is already there
+## i.e. INSERT ... ON DUPLICATE KEY UPDATE on MySQL and INSERT ... ON CONFLICT DO UPDATE on SQLite
+## MySQL's default collation compares café and cafe (or straße and strasse) as the same term,
+## so even a post's own terms can collide there, and a plain INSERT would fail
+def upsert_terms(connection):
+  table = SearchTerm.__table__
+
+  if connection.dialect.name == 'mysql':
+    from sqlalchemy.dialects.mysql import insert
+    statement = insert(table)
+    return statement.on_duplicate_key_update(weight=table.c.weight + statement.inserted.weight)
+
+  from sqlalchemy.dialects.sqlite import insert
+  statement = insert(table)
+  return statement.on_conflict_do_update(
+    index_elements=[table.c.term, table.c.post_id],
+    set_={'weight': table.c.weight + statement.excluded.weight}
+  )
+
+# add weights to a post's terms, creating the terms it doesn't have yet
+## connection is the connection of the caller's transaction, so the index commits with the change it is for
+## weights is a Counter of term -> weight to add (a negative weight takes some away)
+def add_terms(connection, post_id, weights):
+  rows = [
+    {'term': term, 'post_id': int(post_id), 'weight': weight}
+    for term, weight in sorted(weights.items())
+    if weight
+  ]
+  if not rows:
+    return
+
+  table = SearchTerm.__table__
+  connection.execute(upsert_terms(connection), rows)
+
+  # a word that was taken out of a title may have nothing left
+  if any(weight < 0 for weight in weights.values()):
+    connection.execute(
+      table.delete()
+      .where(table.c.post_id == int(post_id))
+      .where(table.c.weight <= 0)
+    )
+
+# the index updates for each write route
+def index_post(connection, post_id, title):
+  add_terms(connection, post_id, term_weights(title, TITLE_WEIGHT))
+
+def reindex_title(connection, post_id, old_title, new_title):
+  weights = term_weights(new_title, TITLE_WEIGHT)
+  weights.subtract(term_weights(old_title, TITLE_WEIGHT))
+  add_terms(connection, post_id, weights)
+
+def index_comment(connection, post_id, comment_text):
+  add_terms(connection, post_id, term_weights(comment_text))
+
+# a deleted post's terms go with it: the post_id foreign key has ON DELETE CASCADE
+
+# build the whole index again from the posts and comments tables, i.e. after a bulk import
+## engine is the engine from app.db; each chunk of posts gets its own transaction
+# returns the number of posts indexed
+def rebuild(engine):
+  with engine.begin() as connection:
+    connection.execute(SearchTerm.__table__.delete())
+
+  indexed = 0
+  last_id = 0
+  while True:
+    with engine.begin() as connection:
+      last_id, count = index_chunk(connection, last_id)
+    if not count:
+      return indexed
+    indexed += count
+
+# index the next REBUILD_CHUNK posts after last_id, with all their comments
+# returns the last post id it indexed and how many posts that was
+def index_chunk(connection, last_id):
+  posts = connection.execute(
+    select([Post.id, Post.title])
+    .where(Post.id > last_id)
+    .order_by(Post.id)
+    .limit(REBUILD_CHUNK)
+  ).all()
+  if not posts:
+    return last_id, 0
+
+  weights = {post.id: term_weights(post.title, TITLE_WEIGHT) for post in posts}
+  comments = connection.execute(
+    select([Comment.post_id, Comment.comment_text])
+    .where(Comment.post_id.between(posts[0].id, posts[-1].id))
+  )
+  for comment in comments:
+    if comment.post_id in weights:
+      weights[comment.post_id].update(term_weights(comment.comment_text))
+
+  rows = [
+    {'term': term, 'post_id': post_id, 'weight': weight}
+    for post_id, counts in weights.items()
+    for term, weight in counts.items()
+  ]
+  if rows:
+    # the same upsert as add_terms(), since terms that MySQL compares as equal would break a plain INSERT
+    connection.execute(upsert_terms(connection), rows)
+
+  return posts[-1].id, len(posts)
+
+# read the search box into (word, prefix) pairs
+# a word ending in * matches every word that starts with it, i.e. pyth* finds python and pythonic
+def parse_query(text):
+  words = []
+  for part in (text or '').split()[:MAX_QUERY_TERMS]:
+    prefix = part.endswith('*')
+    for term in tokenize(part):
+      if (term, prefix) not in words:
+        words.append((term, prefix))
+  return words
+
+# the condition for the rows of one search word
+def term_filter(term, prefix):
+  if not prefix:
+    return SearchTerm.term == term
+
+  # every term from 'pyth' up to (but not including) 'pyti' starts with 'pyth',
+  # and a range like this works on any database's index
+  upper = term[:-1] + chr(ord(term[-1]) + 1)
+  return (SearchTerm.term >= term) & (SearchTerm.term < upper)
+
+# one page of the posts that contain every word of the search, best match first
+## db is the request's session, before and after are cursors like the feed's
+# returns a Page of rows with the post id and its score, or None if the search has no words we index
+def search(db, text, before=None, after=None, page_size=None):
+  words = parse_query(text)
+  if not words:
+    return None
+
+  # for every word, the posts it appears in and how much weight it has in each
+  ## a prefix can match several terms in the same post, so add those up
+  matches = [
+    db.query(SearchTerm.post_id.label('id'), func.sum(SearchTerm.weight).label('weight'))
+    .filter(term_filter(term, prefix))
+    .group_by(SearchTerm.post_id)
+    .subquery()
+    for term, prefix in words
+  ]
+
+  # only posts that have every word: join the lists together, and rank them by their total weight
+  first = matches[0]
+  score = first.c.weight
+  query = db.query(first.c.id.label('id'))
+  for match in matches[1:]:
+    query = query.join(match, match.c.id == first.c.id)
+    score = score + match.c.weight
+  results = query.add_columns(score.label('score')).subquery()
+
+  # page through the results by (score, id), highest first, just like the hot feed pages by (hot_score, id)
+  return paginate(db.query(results), results.c, before=before, after=after, page_size=page_size, sort_by='score')
+
+# the posts on a page of results, in rank order
+## options are the loading strategies for what the caller shows, i.e. [joinedload(Post.user)]
+def load_posts(db, page, options):
+  ids = [row.id for row in page.items]
+  posts = {post.id: post for post in db.query(Post).options(*options).filter(Post.id.in_(ids))}
+  # skip a post deleted since it was found
+  return [posts[id] for id in ids if id in posts]
@@ -0,0 +1,65 @@
+# turn posts and comments into dictionaries for the JSON read API
+
+# hashlib builds the ETag from the values that decide what a response contains
+import hashlib
+
+# the fields a client can ask for with ?fields=, and how to read each one from a post
+POST_FIELDS = {
+  'id': lambda post: post.id,
+  'title': lambda post: post.title,
+  'post_url': lambda post: post.post_url,
+  'domain': lambda post: post.domain,
+  'user_id': lambda post: post.user_id,
+  'username': lambda post: post.user.username,
+  'created_at': lambda post: post.created_at.isoformat(),
+  'updated_at': lambda post: post.updated_at.isoformat(),
+  'vote_count': lambda post: post.vote_count,
+  'comment_count': lambda post: post.comment_count,
+  'hot_score': lambda post: post.hot_score
+}
+
+# the fields a response has when the client doesn't pass ?fields=
+DEFAULT_POST_FIELDS = [
+  'id', 'title', 'post_url', 'user_id', 'username', 'created_at', 'updated_at', 'vote_count', 'comment_count'
+]
+
+# read the ?fields= query parameter, i.e. 'id,title,vote_count'
+# raises ValueError for a field we don't have, so the route can answer 400
+def parse_fields(text):
+  if not text:
+    return DEFAULT_POST_FIELDS
+
+  fields = [field.strip() for field in text.split(',') if field.strip()]
+  unknown = [field for field in fields if field not in POST_FIELDS]
+  if unknown:
+    raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+
+  # id always comes back, so the client can tell the posts apart
+  return ['id'] + [field for field in fields if field != 'id']
+
+def serialize_comment(comment):
+  return {
+    'id': comment.id,
+    'comment_text': comment.comment_text,
+    'user_id': comment.user_id,
+    'username': comment.user.username,
+    'created_at': comment.created_at.isoformat()
+  }
+
+# the dictionary for one post with just the requested fields
+## include_comments adds the post's comments, oldest first; only pass it when they were eager-loaded
+def serialize_post(post, fields, include_comments=False):
+  data = {field: POST_FIELDS[field](post) for field in fields}
+
+  if include_comments:
+    data['comments'] = [
+      serialize_comment(comment)
+      for comment in sorted(post.comments, key=lambda comment: (comment.created_at, comment.id))
+    ]
+
+  return data
+
+# build a strong ETag from everything that decides what a response contains
+# the routes call it with cheap values (ids, updated_at and counters), so a 304 never has to load or serialize a post
+def make_etag(*parts):
+  return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
@@ -0,0 +1,198 @@
+# record upvotes without ever counting the same user twice for the same post
+# votes can be written straight away, or buffered in memory and written in batches (write-behind mode)
+
+# logging reports flush failures from the background thread, where there is no request to send an error to
+import logging
+# atexit lets us flush the buffered votes when the worker shuts down
+import atexit
+# Counter adds up how many new votes each post got
+from collections import Counter
+# the background flush thread, and a Condition to wake it up early when the buffer is full
+from threading import Thread, Condition
+# sleep() waits a moment before a failed batch is tried again
+from time import sleep
+
+# OperationalError is what a lost connection, a deadlock or a locked SQLite file raise
+from sqlalchemy.exc import OperationalError
+
+from app.models import Post, Vote
+from app.utils import counters, ranking
+
+logger = logging.getLogger(__name__)
+
+# build an INSERT that quietly skips rows that would break the (post_id, user_id) unique constraint
+# i.e. INSERT IGNORE on MySQL and INSERT OR IGNORE on SQLite
+## the two differ for a vote whose post doesn't exist: MySQL's IGNORE skips that row too,
+## while SQLite's OR IGNORE doesn't cover foreign keys, so the whole INSERT fails
+def insert_ignore():
+  return (
+    Vote.__table__.insert()
+    .prefix_with('IGNORE', dialect='mysql')
+    .prefix_with('OR IGNORE', dialect='sqlite')
+  )
+
+# insert a list of votes in one multi-row INSERT and bump the counters of the posts that got new votes
+## connection is the connection of the caller's transaction, so the votes and counters commit together
+## votes is a list of (post_id, user_id) tuples
+# returns a Counter of post_id -> votes written for every post whose count may have changed,
+# so callers know which cached posts are stale (it is empty if every vote was a repeat)
+def record_votes(connection, votes):
+  # the same click can arrive twice in one batch, so drop duplicates before they reach the database
+  rows = [
+    {'post_id': post_id, 'user_id': user_id}
+    for post_id, user_id in sorted(set((int(post_id), int(user_id)) for post_id, user_id in votes))
+  ]
+  if not rows:
+    return Counter()
+
+  inserted = connection.execute(insert_ignore().values(rows)).rowcount
+  if inserted == 0:
+    # every vote was already there, so there is nothing to count
+    return Counter()
+
+  new_votes = Counter(row['post_id'] for row in rows)
+  if inserted == len(rows):
+    # every row was new, so we know exactly how much each counter grew
+    for post_id, amount in new_votes.items():
+      counters.bump(connection, post_id, Post.vote_count, amount)
+  else:
+    # some rows were skipped but we can't tell which, so count those posts again from the votes table
+    counters.recount_votes(connection, new_votes.keys())
+
+  # more votes means a higher hot score
+  ranking.refresh_scores(connection, new_votes.keys())
+
+  return new_votes
+
+# buffers votes in memory and writes them in one transaction every flush_ms milliseconds,
+# or as soon as flush_size votes are waiting, whichever comes first
+class VoteBuffer:
+  # a batch that failed for a reason worth retrying is put back in the buffer,
+  # but if the database stays down the buffer stops growing at this many votes
+  MAX_PENDING = 50000
+
+  def __init__(self):
+    self.engine = None
+    self.flush_ms = 250
+    self.flush_size = 500
+    # called with the Counter from record_votes() after every flush, i.e. to evict cached post cards
+    self.on_flush = None
+    self._pending = []
+    self._condition = Condition()
+    self._thread = None
+    self._stopping = False
+
+  @property
+  def running(self):
+    return self._thread is not None
+
+  # start the background flush thread
+  def start(self, engine, flush_ms=250, flush_size=500, on_flush=None):
+    if self.running:
+      return
+
+    self.engine = engine
+    self.flush_ms = flush_ms
+    self.flush_size = flush_size
+    self.on_flush = on_flush
+    self._stopping = False
+    self._thread = Thread(target=self._run, name='vote-buffer', daemon=True)
+    self._thread.start()
+    # write whatever is still buffered when the worker exits
+    atexit.register(self.stop)
+
+  # flush the remaining votes and stop the background thread
+  def stop(self):
+    if not self.running:
+      return
+
+    with self._condition:
+      self._stopping = True
+      self._condition.notify()
+
+    self._thread.join()
+    self._thread = None
+
+  # a forked worker (i.e. under gunicorn with preload_app) gets a copy of the buffer but not its thread,
+  # so give it a thread of its own; whatever the parent had buffered is the parent's to write
+  def after_fork(self):
+    if not self.running:
+      return
+
+    self._pending = []
+    self._condition = Condition()
+    self._stopping = False
+    self._thread = Thread(target=self._run, name='vote-buffer', daemon=True)
+    self._thread.start()
+
+  # queue one vote; it is written by the next flush
+  def add(self, post_id, user_id):
+    with self._condition:
+      self._pending.append((post_id, user_id))
+      if len(self._pending) >= self.flush_size:
+        self._condition.notify()
+
+  def _run(self):
+    while True:
+      with self._condition:
+        if not self._stopping and len(self._pending) < self.flush_size:
+          self._condition.wait(self.flush_ms / 1000)
+
+        batch, self._pending = self._pending, []
+        stopping = self._stopping
+
+      if batch:
+        # once the worker is stopping there is no later flush to retry in
+        self.flush(batch, retry=not stopping)
+
+      if stopping:
+        return
+
+  # write one batch of votes in a single transaction
+  # the clients were already told their vote counted, so a failure mustn't lose the whole batch:
+  ## a lost connection or a deadlock puts the batch back in the buffer for the next flush (unless retry is False)
+  ## any other error writes the votes one at a time and only drops the ones that fail,
+  ## i.e. on SQLite a vote for a post deleted since it was clicked fails the whole INSERT
+  ## (MySQL's INSERT IGNORE just skips that vote, see insert_ignore())
+  def flush(self, batch, retry=True):
+    try:
+      new_votes = self._write(batch)
+    except OperationalError:
+      if not retry:
+        logger.exception('Failed to flush %d buffered votes', len(batch))
+        return
+
+      logger.warning('Failed to flush %d buffered votes, trying again', len(batch), exc_info=True)
+      self._requeue(batch)
+      # give the database a moment before the next attempt
+      sleep(self.flush_ms / 1000)
+      return
+    except Exception:
+      logger.warning('Failed to flush %d buffered votes, writing them one at a time', len(batch), exc_info=True)
+      new_votes = Counter()
+      for vote in batch:
+        try:
+          new_votes.update(self._write([vote]))
+        except Exception:
+          # there's no request to report this to, so log it
+          logger.exception('Dropped buffered vote %s', vote)
+
+    if new_votes and self.on_flush is not None:
+      self.on_flush(new_votes)
+
+  def _write(self, votes):
+    with self.engine.begin() as connection:
+      return record_votes(connection, votes)
+
+  # put a failed batch back in front of the votes that arrived since
+  def _requeue(self, batch):
+    with self._condition:
+      self._pending = batch + self._pending
+      dropped = len(self._pending) - self.MAX_PENDING
+      if dropped > 0:
+        # the newest votes go, so the ones clients have waited longest for are kept
+        self._pending = self._pending[:self.MAX_PENDING]
+        logger.error('Vote buffer is full, dropped %d votes', dropped)
+
+# the buffer api.upvote uses when VOTE_WRITE_BEHIND is turned on
+buffer = VoteBuffer()
@@ -0,0 +1,49 @@
+# an optional warm-up for a new worker, turned on with WARM_UP in the app config
+# without it the first request to every page pays for compiling its template,
+# and the first few requests each pay for opening a database connection
+# create_app() runs it before returning, so the worker only starts taking requests once it is done
+
+import logging
+from time import perf_counter
+
+from app.db import get_engine, get_replicas
+
+logger = logging.getLogger(__name__)
+
+# compile every HTML template, so the first request to each page doesn't have to
+## jinja_env is the app's template environment (the Flask app's or the Quart app's)
+# returns how many templates were compiled
+def compile_templates(jinja_env):
+  names = jinja_env.list_templates(extensions=['html'])
+  for name in names:
+    jinja_env.get_template(name)
+  return len(names)
+
+# open as many connections as the pool keeps, then hand them all back to it
+## engine is a sync engine
+# returns how many connections were opened
+def prime_pool(engine):
+  # SQLite's pool isn't sized, one connection is enough to check the database is there
+  size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+
+  connections = []
+  try:
+    for _ in range(size):
+      connections.append(engine.connect())
+  finally:
+    for connection in connections:
+      connection.close()
+  return len(connections)
+
+# fill the pools of the engine and every read replica
+def prime_pools():
+  return sum(prime_pool(engine) for engine in [get_engine()] + get_replicas().engines)
+
+def warm_up(app):
+  start = perf_counter()
+  templates = compile_templates(app.jinja_env)
+  connections = prime_pools()
+  logger.info(
+    'Warmed up in %.0f ms: compiled %d templates, opened %d connections',
+    (perf_counter() - start) * 1000, templates, connections
+  )
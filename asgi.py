@@ -0,0 +1,6 @@
+# the entry point for an ASGI server
+# run the following command to use it:
+# hypercorn asgi:app --workers 4
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,5 @@
+# __init__.py file makes the directory it is in a package
+# this package holds the synthetic data generator and the benchmark suite
+# run the following commands to use them:
+# python -m bench.generate --reset --posts 100000
+# python -m bench.run
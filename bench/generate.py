@@ -0,0 +1,183 @@
+# generate a large, realistically skewed data set for benchmarking
+# seeds.py inserts a handful of rows through the ORM; this inserts millions through bulk Core INSERTs instead
+# popularity follows a power law: a few hot posts get most of the votes and comments,
+# and a few very active users cast most of them
+# run the following command to use it (--reset drops every table first, just like seeds.py):
+# python -m bench.generate --reset --users 10000 --posts 1000000 --votes 5000000 --comments 2000000
+
+import argparse
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+from time import perf_counter
+
+from sqlalchemy import select, func
+
+from app.db import Base, get_engine
+from app.models import User, Post, Comment
+from app.utils import counters, ranking, search, votes
+from app.utils.hashing import hash_password
+from app.utils.domains import url_domain
+
+# how many rows go into each INSERT
+CHUNK_SIZE = 10000
+
+WORDS = (
+  'python flask mysql sqlalchemy release security cloud linux rust database cache latency '
+  'startup open source browser kernel compiler scaling outage benchmark privacy design api'
+).split()
+
+DOMAINS = (
+  'github.com', 'nytimes.com', 'medium.com', 'arstechnica.com', 'bbc.co.uk',
+  'wired.com', 'theverge.com', 'python.org', 'stackoverflow.blog', 'example.com'
+)
+
+# cumulative weights for a Zipf (power law) distribution over n items: item i gets weight 1 / (i + 1) ** skew
+# picking with bisect over these is O(log n), so millions of picks stay fast
+def zipf_weights(n, skew):
+  return list(accumulate(1 / (i + 1) ** skew for i in range(n)))
+
+def pick(rng, cum_weights):
+  return bisect(cum_weights, rng.random() * cum_weights[-1])
+
+def sentence(rng, low, high):
+  return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+# insert rows in chunks of CHUNK_SIZE, each in its own transaction
+## make_rows is a generator of row dictionaries
+## insert is the INSERT statement to run (i.e. Post.__table__.insert())
+def bulk_insert(label, insert, make_rows, total):
+  start = perf_counter()
+  chunk = []
+  done = 0
+
+  def flush():
+    with get_engine().begin() as connection:
+      connection.execute(insert, chunk)
+
+  for row in make_rows:
+    chunk.append(row)
+    if len(chunk) == CHUNK_SIZE:
+      flush()
+      done += len(chunk)
+      chunk = []
+      print('\r{}: {}/{}'.format(label, done, total), end='', flush=True)
+
+  if chunk:
+    flush()
+    done += len(chunk)
+
+  print('\r{}: {} rows in {:.1f}s'.format(label, done, perf_counter() - start))
+
+# the highest id already in a table, so a run without --reset adds rows after the existing ones
+def max_id(table):
+  with get_engine().connect() as connection:
+    return connection.execute(select([func.max(table.c.id)])).scalar() or 0
+
+def generate(users, posts, votes_total, comments, days=365, skew=1.1, seed=1):
+  rng = random.Random(seed)
+  now = datetime.now()
+
+  first_user = max_id(User.__table__) + 1
+  first_post = max_id(Post.__table__) + 1
+
+  # every generated user gets the same password, so bcrypt only runs once
+  password = hash_password('password123')
+
+  bulk_insert('users', User.__table__.insert(), (
+    {
+      'id': first_user + i,
+      'username': 'bench{}'.format(first_user + i),
+      'email': 'bench{}@example.com'.format(first_user + i),
+      'password': password
+    }
+    for i in range(users)
+  ), users)
+
+  # user activity and post popularity both follow the power law
+  user_weights = zipf_weights(users, skew)
+  post_weights = zipf_weights(posts, skew)
+
+  # spread posts over the last `days` days; the hot posts (low ranks) get shuffled in among the others
+  post_dates = [now - timedelta(seconds=rng.randint(0, days * 86400)) for _ in range(posts)]
+  # rank -> post id, so the hottest post isn't always the oldest one
+  hot_order = list(range(posts))
+  rng.shuffle(hot_order)
+
+  def post_row(i):
+    # draw from rng in the same order as always, so a seed still generates the same posts
+    title = sentence(rng, 3, 10)[:100]
+    post_url = 'https://{}/{}/{}'.format(rng.choice(DOMAINS), rng.choice(WORDS), i)
+    return {
+      'id': first_post + i,
+      'title': title,
+      'post_url': post_url,
+      'domain': url_domain(post_url),
+      'user_id': first_user + pick(rng, user_weights),
+      'created_at': post_dates[i],
+      'updated_at': post_dates[i]
+    }
+
+  bulk_insert('posts', Post.__table__.insert(), (post_row(i) for i in range(posts)), posts)
+
+  def hot_post():
+    i = hot_order[pick(rng, post_weights)]
+    return first_post + i, post_dates[i]
+
+  # votes repeat a (post, user) pair now and then; INSERT IGNORE drops those like api.upvote does
+  bulk_insert('votes', votes.insert_ignore(), (
+    {'post_id': hot_post()[0], 'user_id': first_user + pick(rng, user_weights)}
+    for _ in range(votes_total)
+  ), votes_total)
+
+  def comment_row():
+    post_id, created_at = hot_post()
+    # a comment is always written after its post
+    commented_at = created_at + timedelta(seconds=rng.randint(0, max(1, int((now - created_at).total_seconds()))))
+    return {
+      'comment_text': sentence(rng, 5, 30)[:255],
+      'post_id': post_id,
+      'user_id': first_user + pick(rng, user_weights),
+      'created_at': commented_at,
+      'updated_at': commented_at
+    }
+
+  bulk_insert('comments', Comment.__table__.insert(), (comment_row() for _ in range(comments)), comments)
+
+  # Core INSERTs skip the counter listeners, so count everything once at the end
+  start = perf_counter()
+  with get_engine().begin() as connection:
+    counters.reconcile(connection)
+  print('counters: reconciled in {:.1f}s'.format(perf_counter() - start))
+
+  # score every post for the hot feed
+  start = perf_counter()
+  ranking.redecay(get_engine(), days=None)
+  print('hot scores: computed in {:.1f}s'.format(perf_counter() - start))
+
+  # the search index is kept up to date by the write routes, which the bulk INSERTs skip
+  start = perf_counter()
+  search.rebuild(get_engine())
+  print('search index: built in {:.1f}s'.format(perf_counter() - start))
+
+def main():
+  parser = argparse.ArgumentParser(description='Generate a large, skewed data set for benchmarking.')
+  parser.add_argument('--users', type=int, default=1000)
+  parser.add_argument('--posts', type=int, default=10000)
+  parser.add_argument('--votes', type=int, default=50000)
+  parser.add_argument('--comments', type=int, default=20000)
+  parser.add_argument('--days', type=int, default=365, help='spread posts over this many days')
+  parser.add_argument('--skew', type=float, default=1.1, help='power law exponent, higher means hotter hot posts')
+  parser.add_argument('--seed', type=int, default=1, help='random seed, so runs are repeatable')
+  parser.add_argument('--reset', action='store_true', help='drop and recreate every table first')
+  args = parser.parse_args()
+
+  if args.reset:
+    Base.metadata.drop_all(get_engine())
+    Base.metadata.create_all(get_engine())
+
+  generate(args.users, args.posts, args.votes, args.comments, args.days, args.skew, args.seed)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,175 @@
+# benchmark the main routes through the Flask test client against the database in DB_URL
+# for each route it reports p50/p95/p99 latency and SQL statements per request,
+# saves the results to bench/results/ and compares them with the previous run
+# run the following commands to use it (use a scratch database, the write routes add rows):
+# python -m bench.generate --reset
+# python -m bench.run --requests 500
+
+import argparse
+import json
+import os
+import random
+import subprocess
+from datetime import datetime
+from time import perf_counter
+
+from sqlalchemy import select, func
+
+from app import create_app
+from app.db import get_engine
+from app.models import Post
+from app.utils.query_counter import count_queries
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# the value at percentile p (0-100) of a sorted list
+def percentile(values, p):
+  if not values:
+    return 0.0
+  index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+  return values[index]
+
+# the ids of the most voted posts and of the users who wrote the most posts,
+# so the benchmark hits the same hot rows real traffic does
+def hot_rows(limit=100):
+  with get_engine().connect() as connection:
+    posts = [row[0] for row in connection.execute(
+      select([Post.id]).order_by(Post.vote_count.desc()).limit(limit)
+    )]
+    users = [row[0] for row in connection.execute(
+      select([Post.user_id]).group_by(Post.user_id).order_by(func.count(Post.id).desc()).limit(limit)
+    )]
+  return posts, users
+
+# every scenario is (name, logged_in, function that sends one request with the test client)
+def scenarios(rng, posts, users):
+  return [
+    ('GET / (logged out)', False, lambda client: client.get('/')),
+    ('GET / (logged in)', True, lambda client: client.get('/')),
+    ('GET /post/<id>', False, lambda client: client.get('/post/{}'.format(rng.choice(posts)))),
+    ('GET /dashboard', True, lambda client: client.get('/dashboard')),
+    ('PUT /api/posts/upvote', True, lambda client: client.put(
+      '/api/posts/upvote', json={'post_id': rng.choice(posts)}
+    )),
+    ('POST /api/comments', True, lambda client: client.post(
+      '/api/comments', json={'post_id': rng.choice(posts), 'comment_text': 'benchmark comment'}
+    ))
+  ]
+
+# send `requests` requests for one scenario and collect latency and query counts
+def run_scenario(app, rng, users, logged_in, send, requests, warmup):
+  client = app.test_client()
+  latencies = []
+  queries = []
+  errors = 0
+
+  for i in range(warmup + requests):
+    # log in as a different active user each time, so upvotes and comments aren't all repeats
+    if logged_in:
+      with client.session_transaction() as session:
+        session['user_id'] = rng.choice(users)
+        session['loggedIn'] = True
+
+    with count_queries(get_engine()) as counted:
+      start = perf_counter()
+      response = send(client)
+      elapsed = perf_counter() - start
+
+    if i < warmup:
+      continue
+
+    if response.status_code >= 400:
+      errors += 1
+    latencies.append(elapsed * 1000)
+    queries.append(counted.count)
+
+  latencies.sort()
+  return {
+    'requests': requests,
+    'errors': errors,
+    'p50_ms': percentile(latencies, 50),
+    'p95_ms': percentile(latencies, 95),
+    'p99_ms': percentile(latencies, 99),
+    'mean_ms': sum(latencies) / len(latencies) if latencies else 0.0,
+    'queries_per_request': sum(queries) / len(queries) if queries else 0.0
+  }
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+# the most recent saved run, to compare against
+def previous_results():
+  if not os.path.isdir(RESULTS_DIR):
+    return None
+
+  files = sorted(f for f in os.listdir(RESULTS_DIR) if f.endswith('.json'))
+  if not files:
+    return None
+
+  with open(os.path.join(RESULTS_DIR, files[-1])) as f:
+    return json.load(f)
+
+def save_results(results):
+  os.makedirs(RESULTS_DIR, exist_ok=True)
+  path = os.path.join(RESULTS_DIR, '{}.json'.format(results['started_at'].replace(':', '-')))
+  with open(path, 'w') as f:
+    json.dump(results, f, indent=2)
+  return path
+
+def print_results(results, previous):
+  print('{:<28} {:>9} {:>9} {:>9} {:>9} {:>7}'.format('route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors'))
+  for name, route in results['routes'].items():
+    line = '{:<28} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>7}'.format(
+      name, route['p50_ms'], route['p95_ms'], route['p99_ms'], route['queries_per_request'], route['errors']
+    )
+
+    # show how p95 moved since the previous run
+    before = (previous or {}).get('routes', {}).get(name)
+    if before and before['p95_ms']:
+      line += '   p95 {:+.1f}% vs {}'.format(
+        (route['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100,
+        previous.get('revision') or previous['started_at']
+      )
+    print(line)
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the main routes with the Flask test client.')
+  parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+  parser.add_argument('--warmup', type=int, default=20, help='untimed requests per route first')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--only', help='only run routes whose name contains this text')
+  parser.add_argument('--no-save', action='store_true', help="don't write the results to bench/results/")
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  # the benchmark sends far more writes per user than the rate limits allow a real client
+  app = create_app({'RATE_LIMITS': {}})
+  posts, users = hot_rows()
+  if not posts:
+    print('No posts found, run python -m bench.generate --reset first')
+    return
+
+  results = {
+    'started_at': datetime.now().isoformat(timespec='seconds'),
+    'revision': git_revision(),
+    'database': get_engine().dialect.name,
+    'requests': args.requests,
+    'routes': {}
+  }
+
+  for name, logged_in, send in scenarios(rng, posts, users):
+    if args.only and args.only not in name:
+      continue
+    results['routes'][name] = run_scenario(app, rng, users, logged_in, send, args.requests, args.warmup)
+
+  previous = previous_results()
+  print_results(results, previous)
+
+  if not args.no_save:
+    print('Saved to {}'.format(save_results(results)))
+
+if __name__ == '__main__':
+  main()
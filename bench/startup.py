@@ -0,0 +1,120 @@
+# measure how long a new worker takes to start and to answer its first requests
+# every run starts a fresh Python process, so nothing is left over from the run before it,
+# and times importing the app, create_app() and the first and second request to each page
+# run the following commands to use it:
+# python -m bench.generate --reset
+# python -m bench.startup --runs 5
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+# the pages a new worker's first visitors are likely to ask for
+ROUTES = ['/', '/?sort=hot', '/post/{post_id}', '/dashboard', '/login']
+
+# what to compare, as (name, app config)
+## every scenario shares one template cache folder, so the ones after the first find it filled in
+SCENARIOS = [
+  ('no template cache', {'TEMPLATE_CACHE': False}),
+  ('template cache, empty', {'TEMPLATE_CACHE': True}),
+  ('template cache, filled', {'TEMPLATE_CACHE': True}),
+  ('template cache + warm-up', {'TEMPLATE_CACHE': True, 'WARM_UP': True})
+]
+
+# runs in the new process: time everything and print the numbers as JSON
+## config is the app config for the scenario
+def child(config):
+  start = perf_counter()
+  from app import create_app
+  imported = perf_counter()
+  app = create_app(config)
+  created = perf_counter()
+
+  from bench.run import hot_rows
+  posts, users = hot_rows(limit=1)
+  if not posts:
+    print(json.dumps({'error': 'No posts found, run python -m bench.generate --reset first'}))
+    return
+
+  # log in, so the homepage is rendered instead of coming from the logged-out page cache
+  client = app.test_client()
+  with client.session_transaction() as session:
+    session['user_id'] = users[0]
+    session['loggedIn'] = True
+
+  urls = [route.format(post_id=posts[0]) for route in ROUTES]
+  times = {}
+  for visit in ('first', 'second'):
+    times[visit] = 0.0
+    for url in urls:
+      request_start = perf_counter()
+      client.get(url)
+      times[visit] += (perf_counter() - request_start) * 1000
+
+  print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_requests_ms': times['first'],
+    'second_requests_ms': times['second']
+  }))
+
+# start a new process for one run of a scenario and read its numbers back
+def run_once(config):
+  output = subprocess.run(
+    [sys.executable, '-m', 'bench.startup', '--child', json.dumps(config)],
+    check=True, capture_output=True, text=True
+  ).stdout
+  # the numbers are the last line, anything before it is logging
+  return json.loads(output.strip().splitlines()[-1])
+
+def main():
+  parser = argparse.ArgumentParser(description='Measure worker start-up time and first request latency.')
+  parser.add_argument('--runs', type=int, default=5, help='new processes per scenario')
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    child(json.loads(args.child))
+    return
+
+  cache_dir = tempfile.mkdtemp(prefix='newsfeed-jinja-')
+  try:
+    print('{} runs per scenario, medians in ms'.format(args.runs))
+    print('{:<26} {:>8} {:>11} {:>8} {:>13} {:>14}'.format(
+      'scenario', 'import', 'create_app', 'ready', 'first visit', 'second visit'
+    ))
+
+    for name, config in SCENARIOS:
+      config = dict(config, TEMPLATE_CACHE_DIR=cache_dir)
+      runs = []
+      for i in range(args.runs):
+        # the empty cache scenario has to start from an empty folder every time
+        if name == 'template cache, empty':
+          shutil.rmtree(cache_dir)
+          cache_dir = tempfile.mkdtemp(prefix='newsfeed-jinja-')
+          config['TEMPLATE_CACHE_DIR'] = cache_dir
+        runs.append(run_once(config))
+
+      if 'error' in runs[0]:
+        print(runs[0]['error'])
+        return
+
+      numbers = {key: median(run[key] for run in runs) for key in runs[0]}
+      print('{:<26} {:>8.1f} {:>11.1f} {:>8.1f} {:>13.1f} {:>14.1f}'.format(
+        name,
+        numbers['import_ms'],
+        numbers['create_app_ms'],
+        numbers['import_ms'] + numbers['create_app_ms'],
+        numbers['first_requests_ms'],
+        numbers['second_requests_ms']
+      ))
+  finally:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+  main()
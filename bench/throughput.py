@@ -0,0 +1,126 @@
+# compare the throughput of the sync read routes (Flask, one thread per request)
+# with the async ones (Quart on one event loop, see app/asgi.py) at the same number of concurrent requests
+# both run in-process against the database in DB_URL, so the numbers only differ by how each path waits on it
+# run the following commands to use it:
+# python -m bench.generate --reset
+# python -m bench.throughput --concurrency 50 --requests 2000
+
+import argparse
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from app.asgi import create_asgi_app
+from bench.run import hot_rows, percentile
+
+# the read routes both paths serve, as functions that build a url
+def routes(rng, posts):
+  return [
+    ('GET /', lambda: '/'),
+    ('GET /?sort=hot', lambda: '/?sort=hot'),
+    ('GET /post/<id>', lambda: '/post/{}'.format(rng.choice(posts))),
+    ('GET /dashboard', lambda: '/dashboard'),
+    ('GET /dashboard/edit/<id>', lambda: '/dashboard/edit/{}'.format(rng.choice(posts)))
+  ]
+
+def summary(latencies, errors, elapsed):
+  latencies.sort()
+  return {
+    'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+    'p50_ms': percentile(latencies, 50),
+    'p99_ms': percentile(latencies, 99),
+    'errors': errors
+  }
+
+# send `requests` requests from `concurrency` threads, each with its own Flask test client
+def run_sync(flask_app, user_id, make_url, requests, concurrency):
+  latencies = []
+  errors = []
+
+  def worker(count):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+      session['user_id'] = user_id
+      session['loggedIn'] = True
+
+    for _ in range(count):
+      start = perf_counter()
+      response = client.get(make_url())
+      latencies.append((perf_counter() - start) * 1000)
+      if response.status_code >= 400:
+        errors.append(response.status_code)
+
+  start = perf_counter()
+  with ThreadPoolExecutor(concurrency) as pool:
+    list(pool.map(worker, [requests // concurrency] * concurrency))
+  return summary(latencies, len(errors), perf_counter() - start)
+
+# send `requests` requests from `concurrency` tasks on one event loop, each with its own Quart test client
+async def run_async(quart_app, user_id, make_url, requests, concurrency):
+  latencies = []
+  errors = []
+
+  async def worker(count):
+    client = quart_app.test_client()
+    async with client.session_transaction() as session:
+      session['user_id'] = user_id
+      session['loggedIn'] = True
+
+    for _ in range(count):
+      start = perf_counter()
+      response = await client.get(make_url())
+      await response.get_data()
+      latencies.append((perf_counter() - start) * 1000)
+      if response.status_code >= 400:
+        errors.append(response.status_code)
+
+  start = perf_counter()
+  await asyncio.gather(*[worker(requests // concurrency) for _ in range(concurrency)])
+  return summary(latencies, len(errors), perf_counter() - start)
+
+async def run_all_async(quart_app, user_id, scenarios, requests, concurrency):
+  results = {}
+  # test_app() runs the Quart app's startup and shutdown, which closes the async pool at the end
+  async with quart_app.test_app():
+    for name, make_url in scenarios:
+      results[name] = await run_async(quart_app, user_id, make_url, requests, concurrency)
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare sync and async read route throughput.')
+  parser.add_argument('--requests', type=int, default=1000, help='requests per route and path')
+  parser.add_argument('--concurrency', type=int, default=20, help='requests in flight at once')
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  posts, users = hot_rows()
+  if not posts:
+    print('No posts found, run python -m bench.generate --reset first')
+    return
+
+  # log in so every request reaches the database instead of the logged-out page cache
+  # let every request through, so both paths are measured waiting for connections rather than being turned away
+  app = create_asgi_app({'MAX_CONCURRENT_REQUESTS': 0})
+  scenarios = routes(rng, posts)
+
+  sync_results = {
+    name: run_sync(app.flask_app, users[0], make_url, args.requests, args.concurrency)
+    for name, make_url in scenarios
+  }
+  async_results = asyncio.run(run_all_async(app.quart_app, users[0], scenarios, args.requests, args.concurrency))
+
+  print('{} requests per route, {} concurrent'.format(args.requests, args.concurrency))
+  print('{:<26} {:>10} {:>10} {:>9} {:>9} {:>9}'.format('route', 'sync rps', 'async rps', 'change', 'sync p99', 'async p99'))
+  for name, _ in scenarios:
+    sync, aio = sync_results[name], async_results[name]
+    change = (aio['requests_per_second'] - sync['requests_per_second']) / sync['requests_per_second'] * 100
+    print('{:<26} {:>10.1f} {:>10.1f} {:>8.1f}% {:>9.2f} {:>9.2f}'.format(
+      name, sync['requests_per_second'], aio['requests_per_second'], change, sync['p99_ms'], aio['p99_ms']
+    ))
+    if sync['errors'] or aio['errors']:
+      print('    errors: sync {}, async {}'.format(sync['errors'], aio['errors']))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,113 @@
+# this script makes sure our routes don't slip back into N+1 queries
+# it builds a throwaway SQLite database with a fixed set of posts, comments and votes,
+# requests every page and fails if a route sends more SQL statements than its budget
+# it never touches the database in DB_URL, so CI can run it with no setup:
+# python check_queries.py
+# or collect it with pytest:
+# python -m pytest check_queries.py
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# point the app at a new database before anything creates the engine
+## load_dotenv() doesn't override variables that are already set, so a .env file can't point it elsewhere
+_db_dir = tempfile.mkdtemp(prefix='check_queries-')
+atexit.register(shutil.rmtree, _db_dir, ignore_errors=True)
+os.environ['DB_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'check_queries.db')
+os.environ['DB_PROFILE'] = 'test'
+os.environ['REPLICA_DB_URLS'] = ''
+# the fixture's passwords don't need to be hard to crack
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+from app import create_app
+from app.db import Session, Base, get_engine
+from app.models import User, Post, Comment, Vote
+from app.utils.query_counter import count_queries
+
+# the most SQL statements each route is allowed to send, no matter how many posts or comments it shows
+## feed pages: one query for the page of posts joined with their authors
+## post pages: one query for the post and author, plus one IN (...) query for the comments and their authors
+## / and /post also read a few columns first to build the ETag, so a 304 can skip everything else
+BUDGETS = {
+  '/': 2,
+  '/post/{post_id}': 3,
+  '/dashboard': 1,
+  '/dashboard/edit/{post_id}': 2
+}
+
+# how big the fixture is: enough posts, authors and comments that an N+1 query would show up as extra statements
+USERS = 4
+POSTS = 12
+
+# create the tables and fill them with the same rows every time
+# returns the post that has the most comments, so the post pages have something to load
+def seed():
+  Base.metadata.create_all(get_engine())
+  db = Session()
+
+  db.add_all([
+    User(username='user{}'.format(i), email='user{}@example.com'.format(i), password='password123')
+    for i in range(1, USERS + 1)
+  ])
+  db.commit()
+
+  # every user has posts, so the homepage shows several authors
+  db.add_all([
+    Post(title='Post number {}'.format(i), post_url='https://example{}.com/post'.format(i), user_id=1 + i % USERS)
+    for i in range(1, POSTS + 1)
+  ])
+  db.commit()
+
+  # comments from every user on the first post, and one on a few others
+  db.add_all(
+    [Comment(comment_text='Comment from user {}'.format(i), user_id=i, post_id=1) for i in range(1, USERS + 1)] +
+    [Comment(comment_text='Another comment', user_id=1, post_id=post_id) for post_id in (2, 3, 4)]
+  )
+  db.add_all([Vote(user_id=i, post_id=1) for i in range(1, USERS + 1)])
+  db.commit()
+
+  post = db.query(Post).order_by(Post.comment_count.desc()).first()
+  # read what the routes need before the session closes
+  post_id, user_id = post.id, post.user_id
+  db.close()
+
+  return post_id, user_id
+
+# request every route in BUDGETS and print how many statements each sent
+# returns True if every route answered 200 within its budget
+def check_budgets():
+  app = create_app()
+  engine = get_engine()
+  client = app.test_client()
+  post_id, user_id = seed()
+
+  # log in as the post's author so the dashboard routes render instead of redirecting
+  with client.session_transaction() as session:
+    session['user_id'] = user_id
+    session['loggedIn'] = True
+
+  passed = True
+  for route, budget in BUDGETS.items():
+    url = route.format(post_id=post_id)
+
+    with count_queries(engine) as queries:
+      response = client.get(url)
+
+    ok = response.status_code == 200 and queries.count <= budget
+    passed = passed and ok
+    print('{} {} {} queries (budget {})'.format('ok  ' if ok else 'FAIL', url, queries.count, budget))
+
+    if not ok:
+      for statement in queries.statements:
+        print('    ' + ' '.join(statement.split()))
+
+  return passed
+
+# the same check for pytest
+def test_query_budgets():
+  assert check_budgets(), 'a route sent more SQL statements than its budget (see the output above)'
+
+if __name__ == '__main__':
+  sys.exit(0 if check_budgets() else 1)
@@ -0,0 +1,97 @@
+# gunicorn settings for serving the Flask app in production
+# gunicorn reads this file by itself when it is started from this folder:
+# gunicorn wsgi:app
+# every setting can be changed with the environment variables below, i.e. WEB_CONCURRENCY=8 gunicorn wsgi:app
+#
+# gunicorn starts one parent process that loads the app, then forks the worker processes that serve requests
+# the database connections must never be shared between them, because two processes talking over the same
+# MySQL socket mix up each other's results, so the hooks at the bottom make every worker start with empty pools
+
+import multiprocessing
+from os import getenv, environ
+
+# each worker runs `threads` requests at once, and each of those requests holds one database connection
+threads = int(getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# the database only accepts so many connections (MySQL's max_connections is 151 by default),
+# and some have to stay free for cron jobs, migrations and a mysql shell
+## if several servers share the database, give each one its part of max_connections in DB_MAX_CONNECTIONS
+## read replicas get pools of the same size, so they need the same max_connections
+DB_MAX_CONNECTIONS = int(getenv('DB_MAX_CONNECTIONS', 151))
+DB_RESERVED_CONNECTIONS = int(getenv('DB_RESERVED_CONNECTIONS', 10))
+available = DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS
+
+# the usual two workers per core plus one, but no more than the database has connections for
+workers = int(getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, max(available // threads, 1))))
+
+# split the connections between the workers: one per request thread,
+# and one more if there's room, for the vote write-behind thread and the replica lag check
+per_worker = available // workers
+if per_worker < 1:
+  raise SystemExit(
+    '{} workers need more than DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS = {} connections'.format(workers, available)
+  )
+
+# app/db/pool.py reads these when a worker creates its engine, so settings made here apply to every worker
+## an explicit DB_POOL_SIZE or DB_MAX_OVERFLOW wins, as long as it still fits
+environ.setdefault('DB_PROFILE', 'prod')
+environ.setdefault('DB_POOL_SIZE', str(min(threads, per_worker)))
+environ.setdefault('DB_MAX_OVERFLOW', str(max(min(threads + 1, per_worker) - int(environ['DB_POOL_SIZE']), 0)))
+
+pool_size = int(environ['DB_POOL_SIZE']) + int(environ['DB_MAX_OVERFLOW'])
+if pool_size * workers > available:
+  raise SystemExit(
+    '{} workers with {} connections each would open more than the {} connections available'.format(
+      workers, pool_size, available
+    )
+  )
+
+# load the app once in the parent, so the workers share its memory (templates, code) copy-on-write
+# instead of each loading their own copy
+preload_app = True
+
+bind = getenv('BIND', '0.0.0.0:8000')
+# a worker that doesn't answer for this many seconds is killed and replaced
+timeout = int(getenv('GUNICORN_TIMEOUT', 30))
+# on a restart (SIGHUP) or shutdown (SIGTERM) the workers stop taking new requests
+# and get this many seconds to finish the ones they are serving
+graceful_timeout = int(getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# the parent process: the app is loaded and the workers are about to be forked
+# close any connection create_app() opened (i.e. for WARM_UP) so no worker inherits it
+def when_ready(server):
+  from app.db import dispose_engines
+
+  dispose_engines()
+  server.log.info(
+    'Starting %d workers with %d threads and up to %d database connections each',
+    workers, threads, pool_size
+  )
+
+# a new worker, straight after the fork
+def post_fork(server, worker):
+  from app.db import dispose_engines
+  from app.utils import votes
+
+  # forget any pooled connection copied from the parent without closing it, since it's the parent's socket
+  dispose_engines(close=False)
+  # the vote buffer's flush thread wasn't copied into this process
+  votes.buffer.after_fork()
+
+# the worker is ready to take requests
+def post_worker_init(worker):
+  from app.utils.warmup import prime_pools
+
+  # the parent's warm-up filled a pool the workers can't use, so fill this worker's own
+  if worker.wsgi.config['WARM_UP']:
+    prime_pools()
+
+# the worker is shutting down: write the buffered votes and close its connections
+def worker_exit(server, worker):
+  from app.db import dispose_engines
+  from app.utils import votes
+
+  votes.buffer.stop()
+  dispose_engines()
@@ -1,5 +1,9 @@
 from app.models import User, Post, Comment, Vote
-from app.db import Session, Base, engine
+from app.db import Session, Base, get_engine
+from app.utils import domains, ranking, search
+
+# create the engine (and bind Session to it)
+engine = get_engine()
 
 # uses the Base class together with the engine connection variable to do two things:
 # 1. drop all tables
@@ -59,4 +63,13 @@ db.add_all([
 db.commit()
 
 # db.close() closes the session connection (which we should do after seeding)
-db.close()
\ No newline at end of file
+db.close()
+
+# store the domain of every seeded post, like api.create does for new ones
+domains.backfill(engine)
+
+# index the seeded posts and comments for /search, like flask rebuild-search does
+search.rebuild(engine)
+
+# score the seeded posts for the hot feed, like flask redecay-scores --all does
+ranking.redecay(engine, days=None)
@@ -0,0 +1,7 @@
+# the entry point for a WSGI server
+# run the following command to use it (gunicorn.conf.py sets the workers, threads, pool sizes and timeouts):
+# gunicorn wsgi:app
+from app import create_app
+
+# warm up so every worker has its templates compiled and its connections open before its first request
+app = create_app({'WARM_UP': True})